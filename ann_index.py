@@ -0,0 +1,204 @@
+import heapq
+import os
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+
+from embeddings import unit_vectors
+
+
+#: more trees: higher recall, larger index, slower build
+N_TREES = 10
+#: max. words per leaf
+LEAF_SIZE = 50
+#: candidates (exactly scored) per query, None: LEAVES_PER_TREE leaves
+#: (at least top n words) from each tree; more candidates: higher recall,
+#: slower queries
+SEARCH_K = None
+LEAVES_PER_TREE = 2
+
+# ---------------------------------------------------------------------------
+
+
+def fn_index(fn_model: os.PathLike) -> Path:
+    # "Trump.w2v.model" -> "Trump.w2v.ann.npz"
+    return Path(fn_model).with_suffix(".ann.npz")
+
+
+class RPForest:
+    # approximate nearest neighbors (cosine, normalized vectors) with a forest
+    # of random projection trees, each split by the hyperplane between two
+    # random points, queries collect the leaves closest to the query from all
+    # trees (priority queue by margin) and score those candidates exactly
+
+    def __init__(
+        self, n_trees: int = N_TREES, leaf_size: int = LEAF_SIZE, seed: int = 0
+    ):
+        self.n_trees = n_trees
+        self.leaf_size = leaf_size
+        self.seed = seed
+        self.num_vectors = 0
+
+    def build(self, vectors: np.ndarray):
+        rng = np.random.default_rng(self.seed)
+        self._normals, self._offsets, self._children = list(), list(), list()
+        self._leaf_items, self._leaf_bounds = list(), [0]
+
+        items = np.arange(len(vectors))
+        roots = [self._build_tree(vectors, items, rng) for _ in range(self.n_trees)]
+
+        self.roots = np.array(roots, dtype=np.int64)
+        self.normals = np.array(self._normals, dtype=np.float32).reshape(
+            -1, vectors.shape[1]
+        )
+        self.offsets = np.array(self._offsets, dtype=np.float32)
+        self.children = np.array(self._children, dtype=np.int64).reshape(-1, 2)
+        self.leaf_items = np.concatenate(self._leaf_items).astype(np.int64)
+        self.leaf_bounds = np.array(self._leaf_bounds, dtype=np.int64)
+        self.num_vectors = len(vectors)
+        del self._normals, self._offsets, self._children
+        del self._leaf_items, self._leaf_bounds
+        return self
+
+    def _split(self, vectors: np.ndarray, items: np.ndarray, rng):
+        for _ in range(5):
+            a, b = vectors[rng.choice(items, 2, replace=False)]
+            normal = a - b
+            offset = normal @ (a + b) / 2
+            side = vectors[items] @ normal > offset
+            if 0 < side.sum() < len(items):
+                return normal, offset, side
+        # (near) identical vectors, split at random
+        normal = np.zeros(vectors.shape[1], dtype=np.float32)
+        return normal, 0.0, rng.random(len(items)) < 0.5
+
+    def _build_tree(self, vectors: np.ndarray, items: np.ndarray, rng) -> int:
+        # nodes: internal >= 0 (children: [margin <= 0, margin > 0]), leaves
+        # < 0 (leaf -(node + 1)), iterative to not hit the recursion limit
+        root = None
+        stack = [(items, None, 0)]
+        while stack:
+            items, parent, slot = stack.pop()
+            if len(items) <= self.leaf_size:
+                node = -len(self._leaf_bounds)
+                self._leaf_items.append(items)
+                self._leaf_bounds.append(self._leaf_bounds[-1] + len(items))
+            else:
+                normal, offset, side = self._split(vectors, items, rng)
+                node = len(self._offsets)
+                self._normals.append(normal)
+                self._offsets.append(offset)
+                self._children.append([0, 0])
+                stack.append((items[side], node, 1))
+                stack.append((items[~side], node, 0))
+
+            if parent is None:
+                root = node
+            else:
+                self._children[parent][slot] = node
+        return root
+
+    def candidates(self, query: np.ndarray, search_k: int) -> np.ndarray:
+        # items of the leaves closest to the query (over all trees), until
+        # there are search_k (with duplicates)
+        heap = [(-np.inf, int(root)) for root in self.roots]
+        found, num_found = list(), 0
+        while heap and num_found < search_k:
+            priority, node = heapq.heappop(heap)
+            if node < 0:
+                leaf = -node - 1
+                items = self.leaf_items[
+                    self.leaf_bounds[leaf] : self.leaf_bounds[leaf + 1]
+                ]
+                found.append(items)
+                num_found += len(items)
+                continue
+
+            margin = float(self.normals[node] @ query - self.offsets[node])
+            # min-heap: priority is the negated margin of the worst split on
+            # the path (leaves on the side of the query first)
+            left, right = self.children[node].tolist()
+            heapq.heappush(heap, (max(priority, margin), left))
+            heapq.heappush(heap, (max(priority, -margin), right))
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(found))
+
+    def default_search_k(self, topn: int) -> int:
+        return self.n_trees * LEAVES_PER_TREE * max(topn, self.leaf_size)
+
+    def most_similar_batch(
+        self,
+        kv,
+        words: List[str],
+        topn: int = 10,
+        search_k: Optional[int] = SEARCH_K,
+    ) -> List[Optional[list]]:
+        # like embeddings.most_similar_batch, only the candidates are scored
+        vectors = unit_vectors(kv)
+        search_k = search_k or self.default_search_k(topn)
+        results = list()
+        for word in words:
+            if word not in kv.vocab:
+                results.append(None)
+                continue
+            idx = kv.vocab[word].index
+            cands = self.candidates(vectors[idx], search_k)
+            cands = cands[cands != idx]
+            scores = vectors[cands] @ vectors[idx]
+            best = np.argsort(-scores, kind="stable")[:topn]
+            results.append(
+                [
+                    (kv.index2word[i], float(score))
+                    for i, score in zip(cands[best], scores[best])
+                ]
+            )
+        return results
+
+    def save(self, fn: os.PathLike):
+        with open(fn, "wb") as fp:
+            np.savez(
+                fp,
+                params=np.array([self.n_trees, self.leaf_size, self.num_vectors]),
+                roots=self.roots,
+                normals=self.normals,
+                offsets=self.offsets,
+                children=self.children,
+                leaf_items=self.leaf_items,
+                leaf_bounds=self.leaf_bounds,
+            )
+
+    @classmethod
+    def load(cls, fn: os.PathLike) -> "RPForest":
+        with np.load(fn) as data:
+            n_trees, leaf_size, num_vectors = data["params"].tolist()
+            index = cls(n_trees=n_trees, leaf_size=leaf_size)
+            index.num_vectors = num_vectors
+            for name in (
+                "roots",
+                "normals",
+                "offsets",
+                "children",
+                "leaf_items",
+                "leaf_bounds",
+            ):
+                setattr(index, name, data[name])
+        return index
+
+
+def build_index(kv, fn: os.PathLike, n_trees: int = N_TREES) -> RPForest:
+    index = RPForest(n_trees=n_trees).build(unit_vectors(kv))
+    index.save(fn)
+    return index
+
+
+def load_index(kv, fn: os.PathLike) -> Optional[RPForest]:
+    # None if missing or built for other vectors (vocabulary size changed)
+    if not Path(fn).exists():
+        return None
+    index = RPForest.load(fn)
+    if index.num_vectors != len(kv.index2word):
+        print(f"* ANN index {fn} does not match the vectors, exact search")
+        return None
+    return index
@@ -0,0 +1,53 @@
+import sys
+import time
+
+import numpy as np
+
+from ann_index import N_TREES
+from ann_index import RPForest
+from embeddings import most_similar_batch
+from embeddings import unit_vectors
+from query_w2v_model import get_vectors
+
+
+TOP_K = 10
+NUM_QUERIES = 500
+#: candidates per query (search_k) as multiples of the default
+SEARCH_K_FACTORS = (0.5, 1, 2, 5)
+
+
+def run(person="Trump", num_queries=NUM_QUERIES, n_trees=N_TREES):
+    kv = get_vectors(person)
+    rng = np.random.default_rng(0)
+    num_queries = min(int(num_queries), len(kv.index2word))
+    words = rng.choice(kv.index2word, num_queries, replace=False).tolist()
+    print(f"* benchmark on {person}: {len(kv.index2word)} words, {num_queries} queries")
+
+    time_start = time.perf_counter()
+    index = RPForest(n_trees=int(n_trees)).build(unit_vectors(kv))
+    time_build = time.perf_counter() - time_start
+    print(f"{f'build index ({index.n_trees} trees)':<32} {time_build:8.3f}s")
+
+    time_start = time.perf_counter()
+    exact = most_similar_batch(kv, words, TOP_K)
+    time_exact = time.perf_counter() - time_start
+    print(f"{'exact (batched)':<32} {time_exact:8.3f}s  recall 1.000")
+
+    for factor in SEARCH_K_FACTORS:
+        search_k = int(factor * index.default_search_k(TOP_K))
+        time_start = time.perf_counter()
+        approx = index.most_similar_batch(kv, words, TOP_K, search_k=search_k)
+        time_approx = time.perf_counter() - time_start
+
+        recall = np.mean(
+            [
+                len({w for w, _ in a} & {w for w, _ in e}) / max(len(e), 1)
+                for a, e in zip(approx, exact)
+            ]
+        )
+        name = f"ANN search_k={search_k}"
+        print(f"{name:<32} {time_approx:8.3f}s  recall {recall:.3f}")
+
+
+if __name__ == "__main__":
+    run(*sys.argv[1:])
@@ -0,0 +1,56 @@
+import sys
+import time
+
+from download_all import FN_SHEET_INFO
+from download_all import extract_text_blocks
+from download_all import extract_text_blocks_parsel
+from download_all import fetch_all
+from download_all import load_sheet_info
+from download_all import make_session
+
+
+REPEAT = 3
+
+EXTRACTORS = {
+    "parsel (CSS + HTML slicing)": extract_text_blocks_parsel,
+    "lxml (streaming target)": extract_text_blocks,
+}
+
+
+def run(limit=None):
+    tis = load_sheet_info(FN_SHEET_INFO)
+
+    # pages are served from the web cache after a first download_all.py run
+    pages = fetch_all(make_session(), (ti.url for ti in tis))
+    contents = [page.content for page in pages.values() if page is not None]
+    if limit:
+        contents = contents[:limit]
+    print(f"* benchmark on {len(contents)} pages, best of {REPEAT}")
+
+    results = dict()
+    for name, extract in EXTRACTORS.items():
+        timings = list()
+        for _ in range(REPEAT):
+            time_start = time.perf_counter()
+            dfs = [extract(content) for content in contents]
+            timings.append(time.perf_counter() - time_start)
+        results[name] = dfs
+
+        best = min(timings)
+        print(
+            f"{name:<30} {best:8.3f}s total"
+            f" {best / max(len(contents), 1) * 1000:8.2f}ms/page"
+        )
+
+    # same speaker turns?
+    dfs_old, dfs_new = results.values()
+    num_diff = sum(
+        list(df_old.get("speaker", [])) != list(df_new.get("speaker", []))
+        for df_old, df_new in zip(dfs_old, dfs_new)
+    )
+    print(f"-> {num_diff} pages with different speaker turns")
+
+
+if __name__ == "__main__":
+    limit = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    run(limit)
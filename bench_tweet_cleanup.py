@@ -0,0 +1,93 @@
+import sys
+import time
+
+import pandas as pd
+
+from tweet_cleanup import PAT_HASHTAG
+from tweet_cleanup import PAT_MENTION
+from tweet_cleanup import PAT_PUNCT
+from tweet_cleanup import PAT_PUNCT2
+from tweet_cleanup import PAT_RETWEET
+from tweet_cleanup import PAT_URL
+from tweet_cleanup import PAT_WHITESPACES
+from tweet_cleanup import clean_tweet
+
+
+FN_TWEETS_RAW = "data/tweets_11-06-2020.csv"
+COLUMN_TEXT = "text"
+
+# ---------------------------------------------------------------------------
+# previous cleanup, one regex stage after another over the whole text
+# (row: text, hashtags, retweet, mentions)
+
+
+def stage_whitespaces(row):
+    return (PAT_WHITESPACES.sub(" ", row[0]).strip(),) + row[1:]
+
+
+def stage_hashtags(row):
+    text = row[0]
+    hashtags = " ".join(h.rstrip(""".!;:?"'""") for h in PAT_HASHTAG.findall(text))
+    text = PAT_WHITESPACES.sub(" ", PAT_HASHTAG.sub(" ", text)).strip()
+    return (text, hashtags) + row[2:]
+
+
+def stage_retweet(row):
+    text, retweet = row[0], None
+    match = PAT_RETWEET.search(text)
+    if match:
+        retweet = match.group(1)
+        text = text[len(match.group(0)) :].lstrip()
+    return (text, row[1], retweet) + row[3:]
+
+
+def stage_mentions(row):
+    return row[:3] + (" ".join(PAT_MENTION.findall(row[0])),)
+
+
+def stage_urls(row):
+    return (PAT_WHITESPACES.sub(" ", PAT_URL.sub(" ", row[0])).strip(),) + row[1:]
+
+
+def stage_punctuation(row):
+    text = PAT_PUNCT2.sub(" ", PAT_PUNCT.sub(" ", row[0]) + " ")
+    return (PAT_WHITESPACES.sub(" ", text).strip(),) + row[1:]
+
+
+STAGES = [
+    ("whitespaces", stage_whitespaces),
+    ("hashtags", stage_hashtags),
+    ("retweet", stage_retweet),
+    ("mentions", stage_mentions),
+    ("urls", stage_urls),
+    ("punctuation", stage_punctuation),
+]
+
+# ---------------------------------------------------------------------------
+
+
+def run(fn_csv=FN_TWEETS_RAW, column=COLUMN_TEXT):
+    texts = pd.read_csv(fn_csv)[column].fillna("").tolist()
+    print(f"* benchmark on {len(texts)} tweets")
+
+    rows = [(text, "", None, "") for text in texts]
+    time_total = 0
+    for name, stage in STAGES:
+        time_start = time.perf_counter()
+        rows = [stage(row) for row in rows]
+        time_stage = time.perf_counter() - time_start
+        time_total += time_stage
+        print(f"  regex stage {name:<20} {time_stage:8.3f}s")
+    print(f"{'regex stages (total)':<32} {time_total:8.3f}s")
+
+    time_start = time.perf_counter()
+    results = [clean_tweet(text) for text in texts]
+    time_fused = time.perf_counter() - time_start
+    print(f"{'fused tokenizer':<32} {time_fused:8.3f}s")
+
+    num_diff = sum(row != result for row, result in zip(rows, results))
+    print(f"-> {num_diff} tweets with different results")
+
+
+if __name__ == "__main__":
+    run(*sys.argv[1:])
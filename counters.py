@@ -0,0 +1,169 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from token_table import pos_view
+
+
+#: merge keys of the partial aggregates (besides "amount" and "first")
+WORD_KEYS = ["group", "pos", "is_stop", "is_content", "token"]
+NEIGHBOR_KEYS = ["group", "target", "side", "distance", "neighbor"]
+
+# ---------------------------------------------------------------------------
+
+
+def occurrence_key(doc_ids, offsets):
+    # orders occurrences (document, offset in the document), comparable across
+    # partial counts of different documents, minimum = first occurrence
+    return np.asarray(doc_ids, dtype=np.int64) * 2 ** 32 + offsets
+
+
+def count_tokens(tokens: pd.DataFrame, groups: pd.Series) -> pd.DataFrame:
+    # one pass: amount and first occurrence per (group, pos, stopword, content
+    # word, token), all word class views can be derived from it
+    df = tokens[["pos", "is_stop", "is_content", "token"]].assign(
+        group=groups,
+        pos=tokens["pos"].astype(str),
+        first=occurrence_key(tokens["doc_id"], tokens["position"]),
+    )
+    return (
+        df.groupby(WORD_KEYS, sort=False)
+        .agg(amount=("first", "size"), first=("first", "min"))
+        .reset_index()
+    )
+
+
+def merge_counts(parts: Iterable[pd.DataFrame], keys: List[str]) -> pd.DataFrame:
+    # partial aggregates are added up (first occurrence = minimum)
+    parts = [part for part in parts if part is not None]
+    df = pd.concat(parts, ignore_index=True)
+    return (
+        df.groupby(keys, sort=False)
+        .agg(amount=("amount", "sum"), first=("first", "min"))
+        .reset_index()
+    )
+
+
+def top_n(counts: pd.DataFrame, n: Optional[int] = None) -> pd.DataFrame:
+    # most frequent first, ties in order of first occurrence, only the
+    # candidates for the n largest amounts are sorted (partial selection)
+    amounts = counts["amount"].to_numpy()
+    if n is not None and n < len(counts):
+        nth = np.partition(amounts, len(amounts) - n)[len(amounts) - n]
+        counts = counts[amounts >= nth]
+        amounts = counts["amount"].to_numpy()
+
+    ranking = np.lexsort((counts["first"].to_numpy(), -amounts))
+    return counts.iloc[ranking[:n]]
+
+
+def count_words(
+    word_counts: pd.DataFrame, group: str, view: str, n: Optional[int] = None
+) -> pd.DataFrame:
+    # word class view ("verb", ..., "stop") of one group's partial aggregates
+    df = pos_view(word_counts[word_counts["group"] == group], view)
+    df = df.groupby("token", sort=False).agg(
+        amount=("amount", "sum"), first=("first", "min")
+    )
+    df = top_n(df.reset_index(), n)
+
+    df = df.rename(columns={"token": "word"})
+    return df[["amount", "word"]].reset_index(drop=True)
+
+
+# ---------------------------------------------------------------------------
+
+
+def doc_keys(df: pd.DataFrame, columns: List[str]) -> np.ndarray:
+    # stable document keys (hash of the columns and the n-th duplicate),
+    # unlike "doc_id" (row position) unchanged if rows are inserted before
+    hashes = pd.util.hash_pandas_object(df[columns], index=False)
+    nth = hashes.groupby(hashes.to_numpy()).cumcount()
+    keys = pd.DataFrame({"hash": hashes.to_numpy(), "nth": nth.to_numpy()})
+    return pd.util.hash_pandas_object(keys, index=False).to_numpy()
+
+
+def doc_fingerprints(df: pd.DataFrame, tokens: pd.DataFrame) -> pd.DataFrame:
+    # doc_key -> doc_id and hash of the document's tokens and its row (e.g.
+    # "Who"), to notice changed documents
+    rows = pd.Series(
+        pd.util.hash_pandas_object(
+            df.drop(columns=["doc_id", "doc_key"]), index=False
+        ).to_numpy(),
+        index=df["doc_id"].to_numpy(),
+    )
+    hashes = pd.util.hash_pandas_object(
+        tokens[["position", "token", "is_stop", "is_content"]].assign(
+            pos=tokens["pos"].astype(str)
+        ),
+        index=False,
+    )
+    hashes = hashes.groupby(tokens["doc_id"].to_numpy()).sum()
+    hashes = hashes.reindex(rows.index, fill_value=0).to_numpy(dtype=np.uint64)
+    return pd.DataFrame(
+        {"doc_id": rows.index, "fingerprint": rows.to_numpy() + hashes},
+        index=pd.Index(df["doc_key"].to_numpy(), name="doc_key"),
+    )
+
+
+def renumber_docs(counts: pd.DataFrame, doc_ids: pd.Series) -> pd.DataFrame:
+    # "first" of stored partial counts with the current doc_id of their
+    # documents (doc_ids: stored doc_id -> current doc_id), rows may have
+    # been inserted before them
+    docs, offsets = np.divmod(counts["first"].to_numpy(), 2**32)
+    docs = doc_ids.reindex(docs).to_numpy()
+    return counts.assign(first=occurrence_key(docs, offsets))
+
+
+def load_partials(
+    dn: Optional[os.PathLike], config: dict
+) -> Tuple[pd.Series, Dict[str, pd.DataFrame]]:
+    # counted documents (doc_key -> doc_id, fingerprint) and partial
+    # aggregates, empty if nothing stored or counted with another configuration
+    docs = pd.DataFrame(
+        {
+            "doc_id": pd.Series([], dtype=np.int64),
+            "fingerprint": pd.Series([], dtype=np.uint64),
+        },
+        index=pd.Index([], dtype=np.uint64, name="doc_key"),
+    )
+    if dn is None or not (Path(dn) / "meta.json").exists():
+        return docs, dict()
+
+    with open(Path(dn) / "meta.json", "r", encoding="utf-8") as fp:
+        meta = json.load(fp)
+    if meta["config"] != json.loads(json.dumps(config)):
+        print("* stored partial counts with other configuration, recount")
+        return docs, dict()
+
+    stored = pd.read_parquet(Path(dn) / "docs.parquet")
+    if stored.index.name != "doc_key":
+        print("* stored partial counts without document keys, recount")
+        return docs, dict()
+    docs = stored
+    partials = {
+        name: pd.read_parquet(Path(dn) / f"{name}.parquet") for name in meta["tables"]
+    }
+    return docs, partials
+
+
+def save_partials(
+    dn: os.PathLike,
+    config: dict,
+    docs: pd.DataFrame,
+    partials: Dict[str, pd.DataFrame],
+):
+    dn = Path(dn)
+    dn.mkdir(parents=True, exist_ok=True)
+    docs.rename_axis("doc_key").to_parquet(dn / "docs.parquet")
+    for name, df in partials.items():
+        df.to_parquet(dn / f"{name}.parquet", index=False)
+
+    fn_tmp = dn / "meta.json.tmp"
+    with open(fn_tmp, "w", encoding="utf-8") as fp:
+        json.dump({"config": config, "tables": list(partials)}, fp, indent=1)
+    fn_tmp.replace(dn / "meta.json")
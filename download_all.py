@@ -1,17 +1,23 @@
+import hashlib
+import json
 import os
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from urllib.parse import urlsplit
 from warnings import simplefilter
 
 import numpy as np
 import pandas as pd
 import requests
-from cachecontrol import CacheControl
+from cachecontrol import CacheControlAdapter
 from cachecontrol.caches.file_cache import FileCache
+from lxml import etree
 from parsel import Selector
 from tqdm import tqdm
 
-from typing import List, NamedTuple
+from typing import Dict, Iterable, List, NamedTuple, Optional
 
 
 simplefilter(action="ignore", category=FutureWarning)
@@ -25,13 +31,51 @@ FN_TXT_DIR = Path("txt")
 FN_SHEET_INFO = Path("data/list-of-transcripts.tsv")
 FN_DOCS_XLSX = FN_DOCS_DIR / "transcripts.xlsx"
 FN_DOCS_CSV = FN_DOCS_DIR / "transcripts.csv"
+FN_MANIFEST = FN_DOCS_DIR / "manifest.json"
+FN_PARSE_CACHE_DIR = Path(".parse_cache")
+
+#: bump if extraction/cleanup changes, invalidates parsed documents on disk
+#: and the outputs of all transcriptions (see manifest)
+PARSE_CACHE_VERSION = 2
+
+#: only re-extract transcriptions with changed pages/outputs (see manifest),
+#: otherwise process everything again
+INCREMENTAL = True
+#: check already processed pages for changes (requests are served by the web
+#: cache), otherwise only download new transcriptions
+REFRESH_KNOWN = True
+
+#: number of concurrent downloads, and at most that many per host
+MAX_WORKERS = 8
+MAX_WORKERS_PER_HOST = 4
+#: seconds (connect, read) per request, failed pages are skipped
+REQUEST_TIMEOUT = (10, 60)
+
+PAT_BRACES_DELIMS = re.compile(r"[()]")
+PAT_BRACKETS_DELIMS = re.compile(r"[[\]]")
+
+SPEAKER_NAMES = {
+    "Trump": [
+        "Donald Trump",
+        "President Trump",
+        "Donald J Trump",
+        "Donald J. Trump",
+        "President Donald Trump",
+        "President Donald J. Trump",
+    ],
+    "Biden": [
+        "Joe Biden",
+        "Vice President Joe Biden",
+        "VIce President Biden",
+    ],
+}
 
-OVERWRITE_EXISTING = True
+# ---------------------------------------------------------------------------
 
-PAT_BRACES = re.compile(r"\([^()]*?\)", re.DOTALL | re.UNICODE | re.IGNORECASE)
-PAT_BRACKETS = re.compile(r"\[[^[\]]*?\]", re.DOTALL | re.UNICODE | re.IGNORECASE)
 
-# ---------------------------------------------------------------------------
+class Page(NamedTuple):
+    content: str
+    etag: Optional[str]
 
 
 class TInfo(NamedTuple):
@@ -61,7 +105,127 @@ def load_sheet_info(fn_sheet: os.PathLike) -> List[TInfo]:
     return tis
 
 
-def extract_text_blocks(content: str):
+def hash_text(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def hash_info(ti: TInfo) -> str:
+    # sheet row (title, type, ...) the outputs were written with
+    return hash_text(json.dumps(list(ti), ensure_ascii=False))
+
+
+def hash_file(fn: os.PathLike) -> Optional[str]:
+    fn = Path(fn)
+    if not fn.exists():
+        return None
+    return hashlib.sha1(fn.read_bytes()).hexdigest()
+
+
+def load_manifest(fn: Optional[os.PathLike]) -> dict:
+    manifest = {"transcripts": dict(), "aggregate": dict()}
+    if fn is not None and Path(fn).exists():
+        with open(fn, "r", encoding="utf-8") as fp:
+            manifest.update(json.load(fp))
+    return manifest
+
+
+def save_manifest(manifest: dict, fn: os.PathLike):
+    fn_tmp = Path(fn).with_suffix(".tmp")
+    with open(fn_tmp, "w", encoding="utf-8") as fp:
+        json.dump(manifest, fp, indent=1)
+    fn_tmp.replace(fn)
+
+
+class CalloutTextTarget:
+    # lxml parser target, collects the text of ".fl-callout-text > p" blocks,
+    # each as a list of segments (split at "<br>"), without building a tree
+
+    def __init__(self):
+        self.blocks = list()
+        self._tags = list()
+        self._callout_depth = None
+        self._segments = None
+
+    def start(self, tag, attrib):
+        depth = len(self._tags)
+        self._tags.append(tag)
+
+        if self._segments is not None:
+            if tag == "br":
+                self._segments.append("")
+        elif self._callout_depth is None:
+            if "fl-callout-text" in attrib.get("class", "").split():
+                self._callout_depth = depth
+        elif tag == "p" and depth == self._callout_depth + 1:
+            self._segments = [""]
+
+    def end(self, tag):
+        # close implicitly closed elements, too
+        while self._tags:
+            if self._tags.pop() == tag:
+                break
+        depth = len(self._tags)
+
+        if self._segments is not None and depth <= self._callout_depth + 1:
+            self.blocks.append(self._segments)
+            self._segments = None
+        if self._callout_depth is not None and depth <= self._callout_depth:
+            self._callout_depth = None
+
+    def data(self, data):
+        if self._segments is not None:
+            self._segments[-1] += data
+
+    def close(self):
+        return self.blocks
+
+
+def extract_text_blocks(content: str, chunk_size: int = 64 * 1024):
+    parser = etree.HTMLParser(target=CalloutTextTarget())
+    for pos in range(0, len(content), chunk_size):
+        parser.feed(content[pos : pos + chunk_size])
+    blocks = parser.close()
+
+    if not blocks:
+        return pd.DataFrame(columns=["speaker", "text"])
+
+    rows = list()
+    test_block = blocks[2] if len(blocks) > 2 else blocks[0]
+    if len(test_block) > 1:
+        for i, segments in enumerate(blocks):
+            if not "".join(segments).strip():
+                continue
+            if len(segments) == 1:
+                print(f"! Empty speaker text block @{i}")
+                continue
+
+            header, text = segments[0], " ".join(segments[1:])
+            who = header.split(":", 1)[0].strip()
+            text = text.strip()
+
+            rows.append({"speaker": who, "text": text})
+
+    else:
+        # multi line things?
+        for i in range(0, len(blocks), 2):
+            header = blocks[i]
+            assert len(header) == 1
+            header = header[0]
+            text = " ".join(blocks[i + 1])
+            assert ":" in header
+
+            who = header.split(":", 1)[0].strip()
+            text = text.strip()
+
+            rows.append({"speaker": who, "text": text})
+
+    df = pd.DataFrame.from_dict(rows)
+
+    return df
+
+
+def extract_text_blocks_parsel(content: str):
+    # previous extraction (CSS selector, serialized HTML), see bench_extract.py
     sel = Selector(content)
 
     blocks = sel.css(".fl-callout-text > p").getall()
@@ -103,38 +267,128 @@ def extract_text_blocks(content: str):
     return df
 
 
+def strip_enclosed(text: str, pat_delims: re.Pattern, open_char: str) -> str:
+    # remove balanced "(...)" (incl. nested), unbalanced delimiters are kept,
+    # single scan over the delimiters, kept text pieces on a stack
+    pieces, opened = list(), list()
+    pos = 0
+    for match in pat_delims.finditer(text):
+        pieces.append(text[pos : match.start()])
+        pos = match.end()
+        if match.group() == open_char:
+            opened.append(len(pieces))
+            pieces.append(open_char)
+        elif opened:
+            del pieces[opened.pop() :]
+        else:
+            pieces.append(match.group())
+    pieces.append(text[pos:])
+    return "".join(pieces)
+
+
+def remove_non_speech(text: str) -> str:
+    if "(" in text:
+        text = strip_enclosed(text, PAT_BRACES_DELIMS, "(")
+    if "[" in text:
+        text = strip_enclosed(text, PAT_BRACKETS_DELIMS, "[")
+    return text
+
+
 def cleanup(df):
     # remove annotations / non-speech
-    def remove_non_speech(row):
-        # TODO: filter (...) | [...], non-greedy
-        text = row["text"]
-
-        while True:
-            len_before = len(text)
-            text = PAT_BRACES.sub("", text)
-            if len(text) == len_before:
-                # no change, then nothing more to replace, abort
-                break
+    df["text"] = [remove_non_speech(text) for text in df["text"]]
+
+    return df
 
-        while True:
-            len_before = len(text)
-            text = PAT_BRACKETS.sub("", text)
-            if len(text) == len_before:
-                break
 
-        row["text"] = text
-        return row
+def make_session() -> requests.Session:
+    # like CacheControl(...) but with enough pooled connections for the workers
+    sess = requests.Session()
+    adapter = CacheControlAdapter(
+        cache=FileCache(".web_cache"),
+        pool_connections=MAX_WORKERS,
+        pool_maxsize=MAX_WORKERS_PER_HOST,
+    )
+    sess.mount("http://", adapter)
+    sess.mount("https://", adapter)
+    return sess
 
-    # df.progress_apply(remove_non_speech, axis=1)
-    df.apply(remove_non_speech, axis=1)
+
+def fetch_all(
+    sess,
+    urls: Iterable[str],
+    max_workers: int = MAX_WORKERS,
+    max_workers_per_host: int = MAX_WORKERS_PER_HOST,
+) -> Dict[str, Optional[Page]]:
+    # each page only once, even if listed for multiple speakers (debates)
+    urls = list(dict.fromkeys(urls))
+
+    host_limits = {
+        urlsplit(url).netloc: threading.BoundedSemaphore(max_workers_per_host)
+        for url in urls
+    }
+
+    def fetch_one(url):
+        try:
+            with host_limits[urlsplit(url).netloc]:
+                req = sess.get(url, timeout=REQUEST_TIMEOUT)
+        except requests.RequestException as ex:
+            print(f"Error with request: {ex} - {url}")
+            return None
+        if not req.ok:
+            print(f"Error with request: {req.status_code} - {url}")
+            return None
+        return Page(req.text, req.headers.get("ETag"))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        contents = list(
+            tqdm(
+                executor.map(fetch_one, urls),
+                total=len(urls),
+                desc="Download transcriptions",
+            )
+        )
+
+    return dict(zip(urls, contents))
+
+
+def parse_document(
+    url: str, content: str, cache_dir: os.PathLike = FN_PARSE_CACHE_DIR
+) -> pd.DataFrame:
+    # parsed speaker/text table, stored by URL and page content
+    url_key = hash_text(url)
+    content_key = hash_text(content)
+
+    cache_dir = Path(cache_dir)
+    fn_cache = cache_dir / f"{url_key}-{content_key}-v{PARSE_CACHE_VERSION}.csv"
+    if fn_cache.exists():
+        return pd.read_csv(fn_cache, dtype=str, keep_default_na=False)
+
+    df = extract_text_blocks(content)
+    df = cleanup(df)
+    df = df.reindex(columns=["speaker", "text"])
+
+    # drop outdated versions of this page
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    for fn_old in cache_dir.glob(f"{url_key}-*.csv"):
+        fn_old.unlink()
+    fn_tmp = fn_cache.with_suffix(".tmp")
+    df.to_csv(fn_tmp, index=False)
+    fn_tmp.replace(fn_cache)
 
     return df
 
 
+def filter_by_speaker(df: pd.DataFrame, who: str) -> pd.DataFrame:
+    if who not in SPEAKER_NAMES:
+        raise Exception("invalid speaker?")
+    mask_speaker = df["speaker"].isin(SPEAKER_NAMES[who])
+    return df[mask_speaker].copy()
+
+
 def process_one(
-    sess,
+    df: Optional[pd.DataFrame],
     fn_name: os.PathLike,
-    url: str,
     ti: TInfo,
     filter_speaker: bool = True,
     add_meta: bool = True,
@@ -144,38 +398,16 @@ def process_one(
     save_text: bool = True,
     fn_name_text: os.PathLike = None,
 ):
-    req = sess.get(url)
-    if not req.ok:
-        print(f"Error with request: {fn_name.name} - {url}")
+    if df is None:
+        print(f"Error with request: {fn_name.name} - {ti.url}")
         return
 
-    text = req.text
-
-    df = extract_text_blocks(text)
-
-    df = cleanup(df)
+    # parsed page is shared by all rows with the same URL
+    df = df.copy()
 
     if filter_speaker:
         # print(f"* Filter for speaker: {ti.who}")
-        if ti.who == "Trump":
-            mask_speaker = (
-                (df["speaker"] == "Donald Trump")
-                | (df["speaker"] == "President Trump")
-                | (df["speaker"] == "Donald J Trump")
-                | (df["speaker"] == "Donald J. Trump")
-                | (df["speaker"] == "President Donald Trump")
-                | (df["speaker"] == "President Donald J. Trump")
-            )
-        elif ti.who == "Biden":
-            mask_speaker = (
-                (df["speaker"] == "Joe Biden")
-                | (df["speaker"] == "Vice President Joe Biden")
-                | (df["speaker"] == "VIce President Biden")
-            )
-        else:
-            # mask_speaker = np.one(len(df)).astype(bool)
-            raise Exception("invalid speaker?")
-        df = df[mask_speaker].copy()
+        df = filter_by_speaker(df, ti.who)
 
         # in case we do not want the speaker in the output
         # because it is in the file name ...
@@ -208,18 +440,27 @@ def process_one(
         text = "\r\n\r\n".join(df["Text"].to_list())
         Path(fn_name_text).write_text(text, encoding="utf-8")
 
-    if merge_one and rename_german and len(df) > 0:
-        # group by all except text
-        index_cols = df.columns.tolist()
-        index_cols.remove("Text")
+    if merge_one and rename_german:
+        df = merge_rows(df)
+
+    return df
+
+
+def merge_rows(df: pd.DataFrame) -> pd.DataFrame:
+    if len(df) == 0:
+        return df
 
-        # merge grouped result (text)
-        # df = df.groupby(index_cols)["Text"].apply(list)
-        df = df.groupby(index_cols)["Text"].apply(lambda x: " ".join(x.tolist()))
-        df = df.reset_index()
+    # group by all except text
+    index_cols = df.columns.tolist()
+    index_cols.remove("Text")
 
-        # reorder
-        df = df[["Text", "Wer", "Datum", "Titel", "Link", "Sonstiges"]]
+    # merge grouped result (text)
+    # df = df.groupby(index_cols)["Text"].apply(list)
+    df = df.groupby(index_cols)["Text"].apply(lambda x: " ".join(x.tolist()))
+    df = df.reset_index()
+
+    # reorder
+    df = df[["Text", "Wer", "Datum", "Titel", "Link", "Sonstiges"]]
 
     return df
 
@@ -232,32 +473,124 @@ def run():
         print(f"* create output dir: {FN_TXT_DIR}")
         FN_TXT_DIR.mkdir()
 
-    sess = CacheControl(requests.Session(), cache=FileCache(".web_cache"))
+    sess = make_session()
 
     tis = load_sheet_info(FN_SHEET_INFO)
     # tis = tis[:1]  # TESTING
 
-    dfs = list()
-
-    for ti in tqdm(tis, desc="Process transcriptions"):
-        # output name (determines format (CSV or Excel))
-        fn_name = FN_DOCS_DIR / f"{ti.date}-{ti.who}-{ti.id_}.csv"
-        # fn_name = FN_DOCS_DIR / f"{ti.date}.{ti.who}.{ti.id_}.xlsx"
-
-        fn_name_text = FN_TXT_DIR / f"{ti.date}-{ti.who}-{ti.id_}.txt"
-
-        if not OVERWRITE_EXISTING and fn_name.exists():
-            print(f"* {fn_name} exists. Skip.")
+    manifest = load_manifest(FN_MANIFEST if INCREMENTAL else None)
+
+    def get_key(ti: TInfo) -> str:
+        return f"{ti.date}-{ti.who}-{ti.id_}"
+
+    # output name (determines format (CSV or Excel))
+    def get_fn_name(ti: TInfo) -> Path:
+        return FN_DOCS_DIR / f"{get_key(ti)}.csv"
+        # return FN_DOCS_DIR / f"{get_key(ti)}.xlsx"
+
+    def get_fn_name_text(ti: TInfo) -> Path:
+        return FN_TXT_DIR / f"{get_key(ti)}.txt"
+
+    # forget transcriptions no longer in the sheet
+    entries = {
+        get_key(ti): manifest["transcripts"][get_key(ti)]
+        for ti in tis
+        if get_key(ti) in manifest["transcripts"]
+    }
+    manifest["transcripts"] = entries
+
+    def is_intact(ti: TInfo) -> bool:
+        entry = entries.get(get_key(ti))
+        return (
+            entry is not None
+            and entry["url"] == ti.url
+            and entry.get("info") == hash_info(ti)
+            and entry.get("version") == PARSE_CACHE_VERSION
+            and entry["outputs"]["csv"] == hash_file(get_fn_name(ti))
+            and entry["outputs"]["txt"] == hash_file(get_fn_name_text(ti))
+        )
+
+    intact = {get_key(ti) for ti in tis if is_intact(ti)}
+
+    # download concurrently, then extract in sheet order
+    tis_fetch = tis
+    if not REFRESH_KNOWN:
+        tis_fetch = [ti for ti in tis if get_key(ti) not in intact]
+    pages = fetch_all(sess, (ti.url for ti in tis_fetch))
+
+    tis_todo = list()
+    for ti in tis_fetch:
+        page = pages[ti.url]
+        if get_key(ti) in intact and (
+            page is None
+            or hash_text(page.content) == entries[get_key(ti)]["source_hash"]
+        ):
+            continue
+        tis_todo.append(ti)
+    print(f"* {len(tis_todo)} of {len(tis)} transcriptions new or changed")
+
+    # parse each page once, rows of the same page only filter other speakers
+    urls = [url for url in dict.fromkeys(ti.url for ti in tis_todo) if pages[url]]
+    parsed = {
+        url: parse_document(url, pages[url].content)
+        for url in tqdm(urls, desc="Parse transcriptions")
+    }
+
+    dfs_new = dict()
+
+    for ti in tqdm(tis_todo, desc="Process transcriptions"):
+        fn_name = get_fn_name(ti)
+        fn_name_text = get_fn_name_text(ti)
+
+        df_one = process_one(
+            parsed.get(ti.url), fn_name, ti, fn_name_text=fn_name_text
+        )
+        if df_one is None:
+            # outputs are missing or outdated, retried with the next run
+            entries.pop(get_key(ti), None)
             continue
-
-        df_one = process_one(sess, fn_name, ti.url, ti, fn_name_text=fn_name_text)
         # df_one = df_one.reset_index(drop=True)
-        dfs.append(df_one)
+        dfs_new[get_key(ti)] = df_one
+
+        entries[get_key(ti)] = {
+            "url": ti.url,
+            "info": hash_info(ti),
+            "version": PARSE_CACHE_VERSION,
+            "source_hash": hash_text(pages[ti.url].content),
+            "etag": pages[ti.url].etag,
+            "outputs": {"csv": hash_file(fn_name), "txt": hash_file(fn_name_text)},
+        }
+
+    save_manifest(manifest, FN_MANIFEST)
+
+    # aggregate from the per-document outputs (in sheet order)
+    keys = [get_key(ti) for ti in tis if get_key(ti) in entries]
+    aggregate = {
+        "inputs": hash_text(" ".join(entries[key]["outputs"]["csv"] for key in keys)),
+        "xlsx": hash_file(FN_DOCS_XLSX),
+        "csv": hash_file(FN_DOCS_CSV),
+    }
+    if aggregate == manifest["aggregate"]:
+        print("* aggregate unchanged. Skip.")
+        return
+
+    dfs = list()
+    for ti in tis:
+        key = get_key(ti)
+        if key in dfs_new:
+            dfs.append(dfs_new[key])
+        elif key in entries:
+            df_one = pd.read_csv(get_fn_name(ti), dtype=str, keep_default_na=False)
+            dfs.append(merge_rows(df_one))
 
     df = pd.concat(dfs, axis=0)
     df.to_excel(FN_DOCS_XLSX, index=False)
     df.to_csv(FN_DOCS_CSV, index=False) # , sep=";", encoding="utf-8-sig")
 
+    aggregate.update({"xlsx": hash_file(FN_DOCS_XLSX), "csv": hash_file(FN_DOCS_CSV)})
+    manifest["aggregate"] = aggregate
+    save_manifest(manifest, FN_MANIFEST)
+
 
 # ---------------------------------------------------------------------------
 
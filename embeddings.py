@@ -0,0 +1,171 @@
+import os
+import re
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+from gensim.models import KeyedVectors
+
+
+#: query rows scored against the vocabulary at once (bounds memory)
+BATCH_SIZE = 256
+
+PAT_UNSAFE_CHARS = re.compile(r"[^\w.-]+")
+
+# ---------------------------------------------------------------------------
+
+
+def unit_vectors(kv) -> np.ndarray:
+    # L2-normalized vectors (gensim KeyedVectors), cosine = dot product
+    kv.init_sims()
+    return kv.vectors_norm
+
+
+def fn_model(person: str) -> Path:
+    # "Joe Biden" -> "Joe_Biden.w2v.model"
+    return Path(f"{PAT_UNSAFE_CHARS.sub('_', person)}.w2v.model")
+
+
+def fn_vectors(fn_model: os.PathLike) -> Path:
+    # "Trump.w2v.model" -> "Trump.w2v.kv" (+ "Trump.w2v.kv.vectors.npy")
+    return Path(fn_model).with_suffix(".kv")
+
+
+def export_vectors(model, fn: os.PathLike):
+    # only the normalized word vectors, without the training state, vectors
+    # in a separate .npy file to be memory-mapped
+    kv = KeyedVectors(model.wv.vector_size)
+    kv.add(model.wv.index2word, unit_vectors(model.wv))
+    for word, vocab in kv.vocab.items():
+        vocab.count = model.wv.vocab[word].count
+    kv.save(str(fn), separately=["vectors"])
+
+
+def load_vectors(fn: os.PathLike):
+    # read-only memory-mapped, shared (page cache) by all processes using it
+    kv = KeyedVectors.load(str(fn), mmap="r")
+    kv.vectors_norm = kv.vectors
+    return kv
+
+
+def word_indices(kv, words: List[str]) -> np.ndarray:
+    return np.array([kv.vocab[word].index for word in words], dtype=np.int64)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    # column indices of the k largest scores per row, best first
+    k = min(k, scores.shape[1])
+    idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, idx, axis=1), axis=1)
+    return np.take_along_axis(idx, order, axis=1)
+
+
+def nearest_neighbors(
+    vectors: np.ndarray, idx: np.ndarray, k: int, with_scores: bool = False
+):
+    # k nearest vocabulary entries of the given entries (without themselves)
+    k = max(min(k, len(vectors) - 1), 0)
+    parts, parts_scores = list(), list()
+    for pos in range(0, len(idx), BATCH_SIZE):
+        batch = idx[pos : pos + BATCH_SIZE]
+        scores = vectors[batch] @ vectors.T
+        scores[np.arange(len(batch)), batch] = -np.inf
+        nn = top_k(scores, k)
+        parts.append(nn)
+        parts_scores.append(np.take_along_axis(scores, nn, axis=1))
+
+    nn = np.concatenate(parts) if parts else np.zeros((0, k), dtype=np.int64)
+    if not with_scores:
+        return nn
+    scores = np.concatenate(parts_scores) if parts else np.zeros((0, k))
+    return nn, scores
+
+
+def most_similar_batch(kv, words: List[str], topn: int = 10) -> List[Optional[list]]:
+    # like kv.most_similar per word, all words scored against the vocabulary
+    # in one matrix product (per BATCH_SIZE words), None for unknown words
+    known = [word for word in words if word in kv.vocab]
+    nn, scores = nearest_neighbors(
+        unit_vectors(kv), word_indices(kv, known), topn, with_scores=True
+    )
+    results = {
+        word: [(kv.index2word[i], float(s)) for i, s in zip(row, row_scores)]
+        for word, row, row_scores in zip(known, nn, scores)
+    }
+    return [results.get(word) for word in words]
+
+
+def neighbor_overlap(kv_a, kv_b, words: List[str], k: int = 10) -> np.ndarray:
+    # share of the k nearest neighbors (as words) a word has in both models
+    nn_a = nearest_neighbors(unit_vectors(kv_a), word_indices(kv_a, words), k)
+    nn_b = nearest_neighbors(unit_vectors(kv_b), word_indices(kv_b, words), k)
+
+    # neighbors of b as indices of a (-1 if not in a)
+    b_to_a = np.array(
+        [kv_a.vocab[w].index if w in kv_a.vocab else -1 for w in kv_b.index2word],
+        dtype=np.int64,
+    )
+    return overlap(nn_a, b_to_a[nn_b], k)
+
+
+def overlap(nn_a: np.ndarray, nn_b: np.ndarray, k: int) -> np.ndarray:
+    # share of common entries per row (same index space, -1: none)
+    return (nn_a[:, :, None] == nn_b[:, None, :]).any(axis=2).sum(axis=1) / k
+
+
+def drift_report(kv_a, kv_b, num_words: int = 1_000, k: int = 10) -> pd.DataFrame:
+    # neighbor overlap of the most frequent (in b) shared words, lowest first
+    words = [word for word in kv_b.index2word[:num_words] if word in kv_a.vocab]
+    overlap = neighbor_overlap(kv_a, kv_b, words, k)
+    df = pd.DataFrame({"word": words, "overlap": overlap})
+    return df.sort_values("overlap", kind="stable").reset_index(drop=True)
+
+
+# ---------------------------------------------------------------------------
+
+
+def shared_words(kv_a, kv_b, min_count: int = 1) -> List[str]:
+    # in both vocabularies (order of a), at least min_count times in both
+    return [
+        word
+        for word in kv_a.index2word
+        if word in kv_b.vocab
+        and kv_a.vocab[word].count >= min_count
+        and kv_b.vocab[word].count >= min_count
+    ]
+
+
+def procrustes(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # orthogonal matrix w minimizing |b @ w - a| (rows: same words)
+    u, _, vt = np.linalg.svd(b.T @ a)
+    return u @ vt
+
+
+def compare_spaces(kv_a, kv_b, k: int = 10, min_count: int = 1) -> pd.DataFrame:
+    # b aligned to a (orthogonal Procrustes) on the shared vocabulary, per word:
+    # displacement (cosine distance of the aligned vectors) and overlap of the
+    # k nearest neighbors (within the shared vocabulary), most displaced first
+    if kv_a.vector_size != kv_b.vector_size:
+        raise Exception(f"Different sizes!? {kv_a.vector_size} {kv_b.vector_size}")
+
+    words = shared_words(kv_a, kv_b, min_count=min_count)
+    a = unit_vectors(kv_a)[word_indices(kv_a, words)]
+    b = unit_vectors(kv_b)[word_indices(kv_b, words)]
+    b = b @ procrustes(a, b)
+
+    idx = np.arange(len(words))
+    df = pd.DataFrame(
+        {
+            "word": words,
+            "count_a": [kv_a.vocab[word].count for word in words],
+            "count_b": [kv_b.vocab[word].count for word in words],
+            "displacement": 1 - np.einsum("ij,ij->i", a, b),
+            "overlap": overlap(
+                nearest_neighbors(a, idx, k), nearest_neighbors(b, idx, k), k
+            ),
+        }
+    )
+    df = df.sort_values(["displacement", "overlap"], ascending=[False, True])
+    df.insert(0, "rank", range(1, len(df) + 1))
+    return df.reset_index(drop=True)
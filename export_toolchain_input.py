@@ -1,11 +1,18 @@
+import argparse
+import gzip
+import os
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
 from pathlib import Path
+from typing import List, Tuple
 from warnings import simplefilter
 
+import numpy as np
 import pandas as pd
-from tqdm import tqdm
+
+from storage import read_table
 
 simplefilter(action="ignore", category=FutureWarning)
-tqdm.pandas()
 
 
 FN_DATA_DIR = Path("db")
@@ -21,6 +28,20 @@ SOURCE_HEADER = """<source><location>{source}</location><date>{date}</date><enco
 
 PERSONS = ["Trump", "Biden"]
 
+#: files per person and type (".001.source", ...), ingested concurrently by
+#: the toolchain, 1: a single file
+NUM_SHARDS = 1
+#: write ".source.gz" files (gzip)
+COMPRESS = False
+COMPRESS_LEVEL = 6
+#: documents joined per write, file buffer size (bytes)
+WRITE_CHUNK_SIZE = 10_000
+WRITE_BUFFER_SIZE = 16 * 2**20
+#: files written at the same time
+WORKERS = os.cpu_count()
+
+# ---------------------------------------------------------------------------
+
 
 def get_subset_by_person(df: pd.DataFrame, person: str, col_name: str = "Wer"):
     print(f"* filter dataset by person '{person}'")
@@ -28,48 +49,124 @@ def get_subset_by_person(df: pd.DataFrame, person: str, col_name: str = "Wer"):
 
 
 def lowercase_text(df: pd.DataFrame, colname: str = "text") -> pd.DataFrame:
-    def cleanup_text(row):
-        row[colname] = row[colname].lower()
-        return row
-
     print("* lowercase text")
-    df = df.progress_apply(cleanup_text, axis=1)
-
-    return df
-
-
-def run():
+    return df.assign(**{colname: df[colname].str.lower()})
+
+
+def format_sources(source: pd.Series, date: pd.Series, text: pd.Series) -> pd.Series:
+    # "<header>\n\n<text>\n\n" per document, column-wise string concatenation
+    # (SOURCE_HEADER split at its fields instead of a format() per row)
+    head, rest = SOURCE_HEADER.split("{source}")
+    middle, tail = rest.split("{date}")
+    return (
+        head
+        + source.map(str)
+        + middle
+        + date.map(str)
+        + tail
+        + "\n\n"
+        + text.map(str)
+        + "\n\n"
+    )
+
+
+def transcript_sources(df: pd.DataFrame) -> pd.Series:
+    # df["Title"] ?
+    return format_sources(df["Link"], df["Datum"], df["Text"])
+
+
+def tweet_sources(df: pd.DataFrame) -> pd.Series:
+    # "\n{hashtags}" ?
+    source = df["Who"].astype(str) + "-" + df.index.astype(str)
+    date = df["timestamp"].astype(str).str.split(" ", n=1).str[0]
+    return format_sources(source, date, df["text"])
+
+
+def fn_source(type: str, person: str, shard: int, num_shards: int, compress: bool):
+    # "eng_private-tweets-Trump_2020.source" (+ ".001" ... if sharded, + ".gz")
+    fn = FN_DATA_DIR / FN_SOURCE_OUT.format(type=type, person=person)
+    if num_shards > 1:
+        fn = fn.with_suffix(f".{shard + 1:03d}{fn.suffix}")
+    if compress:
+        fn = fn.with_suffix(f"{fn.suffix}.gz")
+    return fn
+
+
+def write_source(
+    fn: Path, docs: List[str], compress: bool = COMPRESS
+) -> Tuple[Path, int]:
+    # documents joined into large blocks, one write per block
+    if compress:
+        fp = gzip.open(fn, "wt", encoding="utf-8", compresslevel=COMPRESS_LEVEL)
+    else:
+        fp = open(fn, "w", encoding="utf-8", buffering=WRITE_BUFFER_SIZE)
+    with fp:
+        for pos in range(0, len(docs), WRITE_CHUNK_SIZE):
+            fp.write("".join(docs[pos : pos + WRITE_CHUNK_SIZE]))
+    return fn, len(docs)
+
+
+def run(
+    num_shards: int = NUM_SHARDS, compress: bool = COMPRESS, workers: int = WORKERS
+):
     df_docs: pd.DataFrame = pd.read_csv(FN_DOCS_CSV)
-    df_tweets: pd.DataFrame = pd.read_excel(FN_TWEETS_IN)
+    df_tweets: pd.DataFrame = read_table(
+        FN_TWEETS_IN, columns=["Who", "timestamp", "text"]
+    )
 
+    # documents per type and person (formatted), split into consecutive shards
+    jobs = list()
     for person in PERSONS:
         df_person = get_subset_by_person(df_docs, person, col_name="Wer")
         if LOWERCASE:
             df_person = lowercase_text(df_person, colname="Text")
-        fn = FN_DATA_DIR / FN_SOURCE_OUT.format(type="transcripts", person=person)
-        with open(fn, "w", encoding="utf-8") as fp:
-            for _, row in tqdm(df_person.iterrows(), desc="Write source"):
-                header = SOURCE_HEADER.format(source=row["Link"], date=row["Datum"])
-                text = row["Text"]
-                # row["Title"] ?
-                content = f"{header}\n\n{text}\n\n"
-                fp.write(content)
+        jobs.append(("transcripts", person, transcript_sources(df_person)))
 
         df_person = get_subset_by_person(df_tweets, person, col_name="Who")
         if LOWERCASE:
             df_person = lowercase_text(df_person, colname="text")
-        fn = FN_DATA_DIR / FN_SOURCE_OUT.format(type="tweets", person=person)
-        with open(fn, "w", encoding="utf-8") as fp:
-            for idx, row in tqdm(df_person.iterrows(), desc="Write source"):
-                header = SOURCE_HEADER.format(
-                    source=f"{row['Who']}-{idx}", date=row["timestamp"].split(" ", 1)[0]
-                )
-                text = row["text"]
-                # hashtags = row["hashtags"]
-                # "\n{hashtags}"
-                content = f"{header}\n\n{text}\n\n"
-                fp.write(content)
+        jobs.append(("tweets", person, tweet_sources(df_person)))
+
+    FN_DATA_DIR.mkdir(parents=True, exist_ok=True)
+    print(f"* write {len(jobs) * num_shards} source files, {workers} at once")
+    # threads: writing and compressing (zlib) run without the GIL
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                write_source,
+                fn_source(type, person, shard, num_shards, compress),
+                docs.tolist(),
+                compress,
+            )
+            for type, person, sources in jobs
+            for shard, docs in enumerate(np.array_split(sources, num_shards))
+        ]
+        for future in as_completed(futures):
+            fn, num_docs = future.result()
+            print(f"-> {fn} ({num_docs} documents)")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export transcripts and tweets as source files (corpus toolchain)"
+    )
+    parser.add_argument(
+        "--shards", type=int, default=NUM_SHARDS, help="files per person and type"
+    )
+    parser.add_argument(
+        "--gzip", action="store_true", help="compressed '.source.gz' files"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=WORKERS, help="files written at the same time"
+    )
+    args = parser.parse_args()
+
+    run(
+        num_shards=max(1, args.shards),
+        compress=COMPRESS or args.gzip,
+        workers=args.workers,
+    )
 
 
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    main()
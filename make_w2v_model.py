@@ -1,55 +1,308 @@
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
 from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
 
 import pandas as pd
-import spacy
 from gensim.models import Word2Vec
-from tqdm import tqdm
+
+from ann_index import build_index
+from ann_index import fn_index
+from embeddings import PAT_UNSAFE_CHARS
+from embeddings import drift_report
+from embeddings import export_vectors
+from embeddings import fn_model
+from embeddings import fn_vectors
+from nlp_pipeline import AnnotationStore
+from nlp_pipeline import annotate_texts
 
 
 FN_DOCS_CSV = Path("docs/transcripts.csv")
+#: tokenized sentences per person, one sentence per line (gensim corpus_file)
+FN_CORPUS_DIR = Path(".w2v_corpus")
+
+#: speakers (column "Wer") to train models for, None for all
+PERSONS = None
+
+#: only tokens and (rule-based) sentence boundaries, no tagger/parser/vectors
+NLP_NEEDS = ("tokens", "sents")
+#: reuse stored annotations (see nlp_pipeline.AnnotationStore)
+USE_ANNOTATION_STORE = True
+#: documents tokenized at once while writing the corpus (bounds memory)
+CORPUS_CHUNK_SIZE = 1_000
+
+#: consumed documents per model (update only with new documents)
+FN_MANIFEST = Path("w2v_manifest.json")
+FN_DRIFT_REPORT = Path("w2v_drift.csv")
+
+#: update existing models with the new documents (build_vocab(update=True))
+#: instead of retraining, if trained with the same parameters
+INCREMENTAL = True
+#: most frequent words and their nearest neighbors compared in the drift report
+DRIFT_WORDS = 1_000
+DRIFT_TOP_K = 10
+
+#: build an approximate nearest neighbor index per model (see ann_index.py)
+BUILD_ANN_INDEX = True
+
+#: word2vec hyperparameters
+SIZE = 100
+WINDOW = 7
+MIN_COUNT = 1
+ITER = 30
+#: cores for training, split across the models trained at the same time
+WORKERS = os.cpu_count()
+
+
+def fn_corpus(person: str, new: bool = False) -> Path:
+    suffix = ".new.txt" if new else ".txt"
+    return FN_CORPUS_DIR / f"{PAT_UNSAFE_CHARS.sub('_', person)}{suffix}"
+
 
-PERSONS = ["Trump", "Biden"]
+def doc_keys(df: pd.DataFrame) -> pd.Series:
+    # identifies a transcript of a speaker (rows of a debate share the link)
+    return df["Wer"].astype(str) + "|" + df["Link"].astype(str)
 
 
-def get_subset_by_person(df, person):
-    print(f"* filter dataset by person '{person}'")
-    return df[df["Wer"] == person]
+def load_manifest(fn: os.PathLike) -> dict:
+    # person -> {"params": model parameters, "docs": consumed document keys}
+    if not Path(fn).exists():
+        return dict()
+    with open(fn, "r", encoding="utf-8") as fp:
+        return json.load(fp)
 
 
-def train_model(df, nlp):
-    sentences = list()
-    print("* tokenize documents")
-    for text in tqdm(df["Text"], desc="Tokenize"):
-        doc = nlp(text)
-        for sent in doc.sents:
-            tokens = list(sent)
-            # tokens = [tok for tok in tokens if tok.is_stop]
-            sentences.append([tok.text for tok in tokens])
-    print(f"-> got {len(sentences)} sentences in {len(df)} documents.")
+def save_manifest(manifest: dict, fn: os.PathLike):
+    fn_tmp = Path(fn).with_suffix(".tmp")
+    with open(fn_tmp, "w", encoding="utf-8") as fp:
+        json.dump(manifest, fp, indent=1)
+    fn_tmp.replace(fn)
 
-    print("* train word2vec model")
+
+def write_corpora(
+    df: pd.DataFrame,
+    persons: List[str],
+    store=None,
+    known: Optional[Dict[str, Set[str]]] = None,
+) -> Dict[str, Tuple[int, int]]:
+    # tokenize all documents once, one file per person with one sentence per
+    # line, tokens separated by spaces, whitespace tokens are dropped (gensim
+    # splits lines at any whitespace), for the persons in known (models to
+    # update) sentences of documents not in known[person] also go to
+    # "<person>.new.txt"
+    # returns: person -> number of sentences (all, new)
+    known = known or dict()
+    df = df[df["Wer"].isin(persons)]
+    print(f"* tokenize {len(df)} documents -> {FN_CORPUS_DIR}/")
+    FN_CORPUS_DIR.mkdir(parents=True, exist_ok=True)
+    fns = {
+        person: [fn_corpus(person)]
+        + ([fn_corpus(person, new=True)] if person in known else [])
+        for person in persons
+    }
+    fps = {
+        person: [open(fn.with_suffix(".tmp"), "w", encoding="utf-8") for fn in files]
+        for person, files in fns.items()
+    }
+    num_sents = {person: [0, 0] for person in persons}
+    try:
+        for pos in range(0, len(df), CORPUS_CHUNK_SIZE):
+            chunk = df.iloc[pos : pos + CORPUS_CHUNK_SIZE]
+            anns = annotate_texts(chunk["Text"].tolist(), NLP_NEEDS, store=store)
+            for person, key, ann in zip(chunk["Wer"], doc_keys(chunk), anns):
+                is_new = key not in known.get(person, ())
+                for sent in ann.sentences():
+                    words = " ".join(sent).split()
+                    if not words:
+                        continue
+                    for fp in fps[person] if is_new else fps[person][:1]:
+                        fp.write(" ".join(words))
+                        fp.write("\n")
+                    num_sents[person][0] += 1
+                    num_sents[person][1] += is_new
+    finally:
+        for fp in (fp for files in fps.values() for fp in files):
+            fp.close()
+
+    for person in persons:
+        for fn in fns[person]:
+            fn.with_suffix(".tmp").replace(fn)
+        print(f"-> {person}: {num_sents[person][0]} sentences")
+    return {person: tuple(nums) for person, nums in num_sents.items()}
+
+
+def train_model(
+    fn_corpus,
+    size: int = SIZE,
+    window: int = WINDOW,
+    iter: int = ITER,
+    workers: int = 4,
+):
+    # gensim reads the corpus file itself (per worker, for every epoch)
     model = Word2Vec(
-        sentences=sentences,
-        size=100,
-        window=7,
-        min_count=1,
-        workers=4,
-        iter=30,
+        corpus_file=str(fn_corpus),
+        size=size,
+        window=window,
+        min_count=MIN_COUNT,
+        workers=workers,
+        iter=iter,
     )
     return model
 
 
-def run():
+def update_model(fn_model, fn_corpus_new, workers: int = 4):
+    # extend the vocabulary and train only on the new sentences
+    model = Word2Vec.load(str(fn_model))
+    model.workers = workers
+    model.build_vocab(corpus_file=str(fn_corpus_new), update=True)
+    model.train(
+        corpus_file=str(fn_corpus_new),
+        total_words=model.corpus_total_words,
+        epochs=model.epochs,
+    )
+    return model
+
+
+def train_and_save(
+    person: str, update: bool = False, drift: bool = False, **params
+) -> Tuple[str, Optional[pd.DataFrame]]:
+    if update:
+        model = update_model(
+            fn_model(person), fn_corpus(person, new=True), workers=params["workers"]
+        )
+    else:
+        model = train_model(fn_corpus(person), **params)
+    model.save(str(fn_model(person)))
+
+    report = None
+    if update and drift:
+        # compare with a model trained on everything (not saved)
+        model_full = train_model(fn_corpus(person), **params)
+        report = drift_report(model.wv, model_full.wv, DRIFT_WORDS, DRIFT_TOP_K)
+        report.insert(0, "person", person)
+
+    export_vectors(model, fn_vectors(fn_model(person)))
+    if BUILD_ANN_INDEX:
+        build_index(model.wv, fn_index(fn_model(person)))
+    return person, report
+
+
+def run(
+    persons: Optional[List[str]] = PERSONS,
+    size: int = SIZE,
+    window: int = WINDOW,
+    iter: int = ITER,
+    workers: int = WORKERS,
+    parallel: Optional[int] = None,
+    incremental: bool = INCREMENTAL,
+    drift: bool = False,
+):
     df = pd.read_csv(FN_DOCS_CSV)
+    if not persons:
+        persons = df["Wer"].dropna().unique().tolist()
+
+    # models with the same parameters are only updated with new documents
+    manifest = load_manifest(FN_MANIFEST)
+    model_params = dict(size=size, window=window, min_count=MIN_COUNT)
+    update = {
+        person: incremental
+        and fn_model(person).exists()
+        and manifest.get(person, dict()).get("params") == model_params
+        for person in persons
+    }
+    known = {
+        person: set(manifest[person]["docs"]) for person in persons if update[person]
+    }
+
+    store = AnnotationStore() if USE_ANNOTATION_STORE else None
+    num_sents = write_corpora(df, persons, store, known)
+    persons = [person for person in persons if num_sents[person][0]]
+    for person in persons:
+        if update[person] and not num_sents[person][1]:
+            print(f"-> {person}: no new documents, model is up to date")
+    persons = [
+        person for person in persons if not update[person] or num_sents[person][1]
+    ]
+    if not persons:
+        return
+
+    # models at the same time, each with its share of the cores
+    parallel = min(parallel or workers, len(persons), workers) or 1
+    params = dict(
+        size=size, window=window, iter=iter, workers=max(1, workers // parallel)
+    )
+    print(
+        f"* train/update {len(persons)} word2vec models, {parallel} at once"
+        f" ({params['workers']} workers each)"
+    )
+    reports = list()
+    with ProcessPoolExecutor(max_workers=parallel) as executor:
+        futures = [
+            executor.submit(
+                train_and_save, person, update=update[person], drift=drift, **params
+            )
+            for person in persons
+        ]
+        for future in as_completed(futures):
+            person, report = future.result()
+            mode = "updated" if update[person] else "trained"
+            print(f"-> {person}: {fn_model(person)} ({mode})")
+
+            keys = doc_keys(df[df["Wer"] == person])
+            manifest[person] = {"params": model_params, "docs": sorted(set(keys))}
+            save_manifest(manifest, FN_MANIFEST)
+            if report is not None:
+                reports.append(report)
 
-    print("* load spacy model")
-    nlp = spacy.load("en_core_web_lg")
+    if reports:
+        report = pd.concat(reports, ignore_index=True)
+        report.to_csv(FN_DRIFT_REPORT, index=False)
+        print(f"* drift report (neighbors updated vs. retrained) -> {FN_DRIFT_REPORT}")
+        print(report.groupby("person")["overlap"].describe().to_string())
 
-    for person in PERSONS:
-        df_person = get_subset_by_person(df, person)
-        model = train_model(df_person, nlp)
-        model.save(f"{person}.w2v.model")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Train word2vec models per speaker on docs/transcripts.csv"
+    )
+    parser.add_argument(
+        "persons", nargs="*", help="speakers (column 'Wer'), default: all"
+    )
+    parser.add_argument("--size", type=int, default=SIZE)
+    parser.add_argument("--window", type=int, default=WINDOW)
+    parser.add_argument("--iter", type=int, default=ITER)
+    parser.add_argument(
+        "--workers", type=int, default=WORKERS, help="cores for all models"
+    )
+    parser.add_argument(
+        "--parallel", type=int, help="models at the same time, default: --workers"
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="retrain from scratch instead of updating with new documents",
+    )
+    parser.add_argument(
+        "--drift-report",
+        action="store_true",
+        help="also retrain updated models and compare their neighbors",
+    )
+    args = parser.parse_args()
+
+    run(
+        args.persons or PERSONS,
+        size=args.size,
+        window=args.window,
+        iter=args.iter,
+        workers=args.workers,
+        parallel=args.parallel,
+        incremental=INCREMENTAL and not args.full,
+        drift=args.drift_report,
+    )
 
 
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    main()
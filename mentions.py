@@ -0,0 +1,76 @@
+from typing import Dict, Iterable, List
+
+import numpy as np
+import pandas as pd
+
+
+#: entity -> phrases (whitespace-separated token sequences, case-sensitive)
+WATCH_LIST = {
+    "Trump": ("Trump", "Donald Trump", "President Trump"),
+    "Biden": ("Biden", "Joe Biden", "Sleepy Joe"),
+    "Harris": ("Kamala Harris", "Kamala"),
+    "Pence": ("Pence", "Mike Pence"),
+    "Obama": ("Obama", "Barack Obama"),
+}
+
+OTHER = {"Trump": "Biden", "Biden": "Trump"}
+
+# ---------------------------------------------------------------------------
+
+
+def match_entities(
+    tokens: pd.DataFrame, watch_list: Dict[str, Iterable[str]] = WATCH_LIST
+) -> pd.Series:
+    # all watch-list entities per document, in one pass over a token-id
+    # inverted index (only the occurrences of each phrase's first token are
+    # checked, not every document per phrase)
+    # tokens: rows in document order with "doc_id" and "token"
+    # returns: doc_id -> space-joined entities (watch-list order), only
+    # documents with a match
+    doc_ids = tokens["doc_id"].to_numpy()
+    codes, vocab = pd.factorize(tokens["token"])
+    entities = list(watch_list)
+
+    # positions of each token id: order[bounds[code] : bounds[code + 1]]
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(len(vocab) + 1))
+
+    found_docs, found_entities = [], []
+    for entity_idx, entity in enumerate(entities):
+        for phrase in watch_list[entity]:
+            phrase_codes = vocab.get_indexer(phrase.split())
+            if (phrase_codes < 0).any():
+                continue
+
+            first = phrase_codes[0]
+            starts = order[bounds[first] : bounds[first + 1]]
+            for offset, code in enumerate(phrase_codes[1:], 1):
+                starts = starts[starts + offset < len(codes)]
+                starts = starts[
+                    (codes[starts + offset] == code)
+                    & (doc_ids[starts + offset] == doc_ids[starts])
+                ]
+
+            found_docs.append(doc_ids[starts])
+            found_entities.append(np.full(len(starts), entity_idx))
+
+    if not found_docs:
+        return pd.Series([], index=pd.Index([], name="doc_id"), dtype=object)
+
+    found = pd.DataFrame(
+        {
+            "doc_id": np.concatenate(found_docs),
+            "entity": np.concatenate(found_entities),
+        }
+    )
+    found = found.drop_duplicates().sort_values(["doc_id", "entity"])
+    names = np.asarray(entities, dtype=object)[found["entity"]]
+    return pd.Series(names, index=found["doc_id"]).groupby(level=0).agg(" ".join)
+
+
+def mentions_other(df: pd.DataFrame) -> List[bool]:
+    # rows (with "Who" and "entities") where one speaks about the other
+    return [
+        who in OTHER and OTHER[who] in entities.split()
+        for who, entities in zip(df["Who"], df["entities"].fillna(""))
+    ]
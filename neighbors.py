@@ -0,0 +1,118 @@
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+from counters import occurrence_key
+from counters import top_n
+
+SIDES = ("left", "right")
+
+# ---------------------------------------------------------------------------
+
+
+def count_neighbors(
+    tokens: pd.DataFrame,
+    targets: Iterable[str],
+    window: int = 1,
+    groups: Optional[pd.Series] = None,
+) -> pd.DataFrame:
+    # co-occurrences of the target words with the words up to `window`
+    # positions left/right (same document), for all targets (and groups, e.g.
+    # authors) at once on integer-encoded token arrays
+    # tokens: rows in document order with "doc_id" and "token"
+    # returns: group, target, side, distance, neighbor, amount, first (most
+    # frequent first, ties in order of first occurrence, "first" is comparable
+    # across calls, see counters.occurrence_key)
+    doc_ids = tokens["doc_id"].to_numpy()
+    codes, vocab = pd.factorize(tokens["token"])
+    if groups is None:
+        group_codes, group_names = np.zeros(len(codes), dtype=np.int64), [None]
+    else:
+        group_codes, group_names = pd.factorize(groups)
+
+    targets = [target for target in dict.fromkeys(targets) if target in vocab]
+    target_index = np.full(len(vocab) + 1, -1, dtype=np.int64)
+    target_index[vocab.get_indexer(targets)] = np.arange(len(targets))
+    centers = np.flatnonzero(target_index[codes] >= 0)
+
+    parts_center, parts_neighbor, parts_side, parts_distance = [], [], [], []
+    for side, sign in enumerate((-1, 1)):
+        for distance in range(1, window + 1):
+            neighbors = centers + sign * distance
+            valid = (neighbors >= 0) & (neighbors < len(codes))
+            center, neighbor = centers[valid], neighbors[valid]
+            same_doc = doc_ids[center] == doc_ids[neighbor]
+            center, neighbor = center[same_doc], neighbor[same_doc]
+
+            parts_center.append(center)
+            parts_neighbor.append(neighbor)
+            parts_side.append(np.full(len(center), side, dtype=np.int64))
+            parts_distance.append(np.full(len(center), distance, dtype=np.int64))
+
+    center = np.concatenate(parts_center)
+    neighbor = np.concatenate(parts_neighbor)
+    side = np.concatenate(parts_side)
+    distance = np.concatenate(parts_distance)
+
+    # order of occurrence: document, left before right, position, distance
+    order = np.lexsort((distance, center, side, doc_ids[center]))
+    center, neighbor = center[order], neighbor[order]
+    side, distance = side[order], distance[order]
+
+    # one integer key per (group, target, side, distance, neighbor)
+    key = group_codes[center].astype(np.int64)
+    key = key * len(targets) + target_index[codes[center]]
+    key = key * 2 + side
+    key = key * window + (distance - 1)
+    key = key * len(vocab) + codes[neighbor]
+
+    keys, first, amounts = np.unique(key, return_index=True, return_counts=True)
+    ranking = np.lexsort((first, -amounts))
+    keys, first, amounts = keys[ranking], first[ranking], amounts[ranking]
+
+    # first occurrence as (document, n-th pair in the document)
+    first_docs = doc_ids[center[first]]
+    doc_starts = np.searchsorted(doc_ids[center], first_docs)
+    first = occurrence_key(first_docs, first - doc_starts)
+
+    keys, neighbor_codes = np.divmod(keys, max(len(vocab), 1))
+    keys, distances = np.divmod(keys, window)
+    keys, sides = np.divmod(keys, 2)
+    group_codes, target_codes = np.divmod(keys, max(len(targets), 1))
+
+    return pd.DataFrame(
+        {
+            "group": np.asarray(group_names, dtype=object)[group_codes],
+            "target": np.asarray(targets, dtype=object)[target_codes],
+            "side": np.asarray(SIDES, dtype=object)[sides],
+            "distance": distances + 1,
+            "neighbor": np.asarray(vocab, dtype=object)[neighbor_codes],
+            "amount": amounts,
+            "first": first,
+        }
+    )
+
+
+def to_pairs(counts: pd.DataFrame, n: Optional[int] = None) -> pd.DataFrame:
+    # "left"/"right" word pairs, like "word+Trump" / "Trump+word", a target
+    # next to itself is one pair (counted from both sides), n most frequent
+    is_left = counts["side"] == "left"
+    df = pd.DataFrame(
+        {
+            "left": counts["neighbor"].where(is_left, counts["target"]),
+            "right": counts["target"].where(is_left, counts["neighbor"]),
+            "distance": counts["distance"],
+            "amount": counts["amount"],
+            "first": counts["first"],
+        }
+    )
+    df = df.groupby(["left", "right", "distance"], sort=False).agg(
+        amount=("amount", "sum"), first=("first", "min")
+    )
+    df = top_n(df.reset_index(), n)
+
+    columns = ["amount", "left", "right"]
+    if len(df) and df["distance"].max() > 1:
+        columns.append("distance")
+    return df[columns].reset_index(drop=True)
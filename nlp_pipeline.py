@@ -0,0 +1,224 @@
+import hashlib
+import json
+import sqlite3
+import time
+import zlib
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import spacy
+from spacy.util import get_model_meta
+from spacy.util import get_package_path
+from tqdm import tqdm
+
+
+SPACY_MODEL = "en_core_web_lg"
+
+FN_ANNOTATION_STORE = Path(".nlp_cache/annotations.sqlite")
+#: size limit of the stored annotations, least recently used are evicted
+ANNOTATION_STORE_MAX_BYTES = 2 * 1024 ** 3
+
+SPACY_V2 = int(spacy.__version__.split(".", 1)[0]) < 3
+
+#: annotations a stage may need -> pipeline components (spaCy v2 / v3 names),
+#: "tokens" and "sents" alone need no statistical model (tokenizer, sentencizer)
+COMPONENTS = {
+    "tokens": set(),
+    "sents": set(),
+    "pos": {"tok2vec", "tagger", "attribute_ruler"},
+    "deps": {"tok2vec", "parser"},
+    "ents": {"tok2vec", "ner"},
+}
+
+# ---------------------------------------------------------------------------
+
+
+class Annotation(NamedTuple):
+    words: Tuple[str, ...]
+    pos: Tuple[str, ...]
+    is_stop: Tuple[bool, ...]
+    #: token offsets where sentences start (only if "sents" were needed)
+    sent_starts: Tuple[int, ...]
+
+    def sentences(self) -> List[Tuple[str, ...]]:
+        bounds = list(self.sent_starts) + [len(self.words)]
+        return [self.words[start:end] for start, end in zip(bounds, bounds[1:])]
+
+
+def _get_required(needs: Iterable[str]) -> set:
+    return set().union(*(COMPONENTS[need] for need in needs))
+
+
+def pipeline_id(needs: Iterable[str], model: str = SPACY_MODEL) -> str:
+    # identifies the annotations, without loading the model
+    needs = sorted(set(needs))
+    if not _get_required(needs):
+        name = f"blank_{model.split('_', 1)[0]}"
+    else:
+        meta = get_model_meta(get_package_path(model))
+        name = f"{meta['lang']}_{meta['name']}-{meta['version']}"
+    return f"{name}|{'+'.join(needs)}|spacy-{spacy.__version__}"
+
+
+def load_pipeline(needs: Iterable[str], model: str = SPACY_MODEL):
+    needs = set(needs)
+    required = _get_required(needs)
+
+    if not required:
+        # tokenizer only, no model weights, no vectors table
+        print(f"* load blank spacy pipeline ({model.split('_', 1)[0]})")
+        nlp = spacy.blank(model.split("_", 1)[0])
+    else:
+        pipeline = get_model_meta(get_package_path(model))["pipeline"]
+        skip = [name for name in pipeline if name not in required]
+        print(f"* load spacy model {model} (without: {', '.join(skip)})")
+        if SPACY_V2:
+            nlp = spacy.load(model, disable=skip)
+        else:
+            nlp = spacy.load(model, exclude=skip)
+
+    if "sents" in needs and "parser" not in nlp.pipe_names:
+        # rule-based sentence boundaries instead of the dependency parser
+        if SPACY_V2:
+            nlp.add_pipe(nlp.create_pipe("sentencizer"))
+        else:
+            nlp.add_pipe("sentencizer")
+
+    return nlp
+
+
+def annotate(
+    nlp, texts: List[str], batch_size: int = 256, n_process: int = 1
+) -> Iterator[Annotation]:
+    # only keep the token attributes, not the spaCy Doc objects
+    with_sents = "parser" in nlp.pipe_names or "sentencizer" in nlp.pipe_names
+    for doc in nlp.pipe(texts, batch_size=batch_size, n_process=n_process):
+        yield Annotation(
+            tuple(tok.text for tok in doc),
+            tuple(tok.pos_ for tok in doc),
+            tuple(tok.is_stop for tok in doc),
+            tuple(sent.start for sent in doc.sents) if with_sents else (),
+        )
+
+
+# ---------------------------------------------------------------------------
+
+
+class AnnotationStore:
+    # persistent annotations (compressed token attribute arrays) in SQLite,
+    # keyed by text hash and pipeline id, size bounded (LRU eviction)
+
+    def __init__(
+        self,
+        fn: Path = FN_ANNOTATION_STORE,
+        max_bytes: int = ANNOTATION_STORE_MAX_BYTES,
+    ):
+        self.max_bytes = max_bytes
+        Path(fn).parent.mkdir(parents=True, exist_ok=True)
+        self.con = sqlite3.connect(str(fn), timeout=60)
+        self.con.execute(
+            "CREATE TABLE IF NOT EXISTS annotations "
+            "(key TEXT PRIMARY KEY, data BLOB, size INTEGER, last_used REAL)"
+        )
+        self.con.execute(
+            "CREATE INDEX IF NOT EXISTS idx_last_used ON annotations (last_used)"
+        )
+
+    @staticmethod
+    def make_key(text: str, pipeline: str) -> str:
+        return hashlib.sha1(f"{pipeline}\n{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, Annotation]:
+        found = dict()
+        keys = list(set(keys))
+        for pos in range(0, len(keys), 500):
+            batch = keys[pos : pos + 500]
+            marks = ",".join("?" * len(batch))
+            rows = self.con.execute(
+                f"SELECT key, data FROM annotations WHERE key IN ({marks})", batch
+            )
+            for key, data in rows:
+                arrays = json.loads(zlib.decompress(data))
+                found[key] = Annotation(*(tuple(array) for array in arrays))
+        with self.con:
+            self.con.executemany(
+                "UPDATE annotations SET last_used = ? WHERE key = ?",
+                [(time.time(), key) for key in found],
+            )
+        return found
+
+    def put_many(self, items: Dict[str, Annotation]):
+        rows = list()
+        for key, ann in items.items():
+            data = zlib.compress(json.dumps(list(ann)).encode("utf-8"))
+            rows.append((key, data, len(data), time.time()))
+        with self.con:
+            self.con.executemany(
+                "INSERT OR REPLACE INTO annotations VALUES (?, ?, ?, ?)", rows
+            )
+        self.evict()
+
+    def evict(self):
+        (total,) = self.con.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM annotations"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+
+        evict = list()
+        rows = self.con.execute(
+            "SELECT key, size FROM annotations ORDER BY last_used ASC"
+        )
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evict.append((key,))
+            total -= size
+        with self.con:
+            self.con.executemany("DELETE FROM annotations WHERE key = ?", evict)
+
+    def close(self):
+        self.con.close()
+
+
+def annotate_texts(
+    texts: List[str],
+    needs: Iterable[str],
+    model: str = SPACY_MODEL,
+    store: Optional[AnnotationStore] = None,
+    batch_size: int = 256,
+    n_process: int = 1,
+) -> List[Annotation]:
+    # annotations from the store, only missing texts are processed (the
+    # pipeline is only loaded if something is missing)
+    if store is None:
+        nlp = load_pipeline(needs, model=model)
+        return list(annotate(nlp, texts, batch_size=batch_size, n_process=n_process))
+
+    pipeline = pipeline_id(needs, model=model)
+    keys = [store.make_key(text, pipeline) for text in texts]
+    found = store.get_many(keys)
+
+    # duplicate texts share a key, counts are of unique texts
+    missing = {key: text for key, text in zip(keys, texts) if key not in found}
+    print(
+        f"* annotations: {len(texts)} texts ({len(set(keys))} unique),"
+        f" {len(found)} cached, {len(missing)} new"
+    )
+    if missing:
+        nlp = load_pipeline(needs, model=model)
+        anns = annotate(
+            nlp, list(missing.values()), batch_size=batch_size, n_process=n_process
+        )
+        anns = tqdm(anns, total=len(missing), desc="Annotate")
+        new = dict()
+        for key, ann in zip(missing, anns):
+            new[key] = ann
+            if len(new) >= 10_000:
+                store.put_many(new)
+                found.update(new)
+                new = dict()
+        store.put_many(new)
+        found.update(new)
+
+    return [found[key] for key in keys]
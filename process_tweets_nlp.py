@@ -1,131 +1,84 @@
+from typing import Tuple
 from warnings import simplefilter
 
 import pandas as pd
-import spacy
 import transformers
 from tqdm import tqdm
 
+from counters import doc_keys
+from mentions import WATCH_LIST
+from mentions import match_entities
+from mentions import mentions_other
+from nlp_pipeline import AnnotationStore
+from nlp_pipeline import annotate_texts
+from storage import read_table
+from storage import write_table
+from token_table import build_token_table
+from token_table import content_view
+from token_table import save_token_table
+from token_table import to_text_columns
+
 simplefilter(action="ignore", category=FutureWarning)
 tqdm.pandas()
 
 #: email from 30.11.2020
 FN_TWEETS_IN = "data/Tweets_R_TrumpBiden.xlsx"
-FN_TWEETS_OUT = "data/Tweets_R_TrumpBiden_out.xlsx"
+FN_TWEETS_OUT = "data/Tweets_R_TrumpBiden_out.parquet"
+FN_TWEETS_OUT_XLSX = "data/Tweets_R_TrumpBiden_out.xlsx"
+FN_TOKENS_OUT = "data/Tweets_R_TrumpBiden_tokens.parquet"
 
 ONLY_ABOUT_OTHER = True
 
+#: identify a tweet (stable "doc_key", unlike "doc_id" the row position), to
+#: only count new tweets (see process_tweets_nlp_counters.py)
+DOC_KEY_COLUMNS = ["Who", "timestamp", "text"]
 
-def do_work(df):
-
-    print("* load models")
-    nlp = spacy.load("en_core_web_lg")
-
-    def run_spacy(row):
-        doc = nlp(row["text"])
-
-        row["spacy"] = doc
-
-        row["text_stop"] = " ".join(tok.text for tok in doc if tok.is_stop)
-
-        tokens = list(doc)
-        tokens = [tok for tok in tokens if not tok.is_stop]
-        tokens = [
-            tok
-            for tok in tokens
-            if tok.pos_ not in ("PUNCT", "SYM", "CCONJ", "CONJ", "SCONJ")
-        ]
-
-        row["text_tokens"] = " ".join(tok.text for tok in tokens if not tok.is_stop)
-        row["text_pos"] = " ".join(tok.pos_ for tok in tokens if not tok.is_stop)
-
-        row["text_pronoun"] = " ".join(tok.text for tok in tokens if tok.pos_ == "PRON")
-        row["text_noun"] = " ".join(tok.text for tok in tokens if tok.pos_ == "NOUN")
-        row["text_proper_noun"] = " ".join(
-            tok.text for tok in tokens if tok.pos_ == "PROPN"
-        )
-        row["text_adjective"] = " ".join(
-            tok.text for tok in tokens if tok.pos_ == "ADJ"
-        )
-        row["text_adverb"] = " ".join(tok.text for tok in tokens if tok.pos_ == "ADV")
-        row["text_verb"] = " ".join(tok.text for tok in tokens if tok.pos_ == "VERB")
-        row["text_propn_adj"] = " ".join(
-            tok.text for tok in tokens if tok.pos_ in ("ADJ", "PROPN")
-        )
-
-        return row
-
-    def check_has_biden_tump(row):
-        author = row["Who"]
-        text = row["text_tokens"]
-
-        row["about_other"] = False
-
-        if author == "Biden":
-            if " Trump " in f" {text} ":
-                row["about_other"] = True
-        elif author == "Trump":
-            if " Biden " in f" {text} ":
-                row["about_other"] = True
-
-        return row
-
-    def build_bigrams(row):
-        text = row["text_tokens"].split(" ")
-
-        pairs_trump_left, pairs_trump_right = list(), list()
-        pairs_biden_left, pairs_biden_right = list(), list()
-        for w_left, w_middle, w_right in zip(
-            [None] + text[:-1], text, text[1:] + [None]
-        ):
-            if w_middle == "Trump":
-                if w_left:
-                    pairs_trump_left.append(f"{w_left}+{w_middle}")
-                if w_right:
-                    pairs_trump_right.append(f"{w_middle}+{w_right}")
-            elif w_middle == "Biden":
-                if w_left:
-                    pairs_biden_left.append(f"{w_left}+{w_middle}")
-                if w_right:
-                    pairs_biden_right.append(f"{w_middle}+{w_right}")
-
-        row["words_trump+left"] = " ".join(pairs_trump_left)
-        row["words_trump+right"] = " ".join(pairs_trump_right)
-        row["words_biden+left"] = " ".join(pairs_biden_left)
-        row["words_biden+right"] = " ".join(pairs_biden_right)
-
-        row["words_neighbors"] = None
-        if row["about_other"]:
-            if row["Who"] == "Trump":
-                row["words_neighbors"] = " ".join(
-                    [row["words_biden+left"], row["words_biden+right"]]
-                )
-            elif row["Who"] == "Biden":
-                row["words_neighbors"] = " ".join(
-                    [row["words_trump+left"], row["words_trump+right"]]
-                )
-
-        return row
-
-    # --------------------------------
+#: also export the tweets as FN_TWEETS_OUT_XLSX, optionally with the
+#: space-joined "text_*" columns (only for reading, later stages use the
+#: token table)
+EXPORT_EXCEL = False
+EXPORT_TEXT_COLUMNS = False
 
-    print("* run spacy (tokenize, POS-tag, stopwords)")
-    df = df.progress_apply(run_spacy, axis=1)
+#: texts per spaCy batch, number of processes for nlp.pipe
+BATCH_SIZE = 256
+N_PROCESS = 1
+
+#: only tokens, POS tags (and lexical stopwords), no parser/NER
+NLP_NEEDS = ("pos",)
+#: reuse stored annotations (see nlp_pipeline.AnnotationStore)
+USE_ANNOTATION_STORE = True
 
-    print("* mark rows where one speaks about the other")
-    df = df.progress_apply(check_has_biden_tump, axis=1)
 
-    print("* search for neighborhood words")
-    df = df.progress_apply(build_bigrams, axis=1)
+def do_work(
+    df, batch_size=BATCH_SIZE, n_process=N_PROCESS
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    df = df.reset_index(drop=True)
+    df.insert(0, "doc_id", range(len(df)))
+    df.insert(1, "doc_key", doc_keys(df, DOC_KEY_COLUMNS))
+
+    print("* run spacy (tokenize, POS-tag, stopwords)")
+    anns = annotate_texts(
+        df["text"].tolist(),
+        NLP_NEEDS,
+        store=AnnotationStore() if USE_ANNOTATION_STORE else None,
+        batch_size=batch_size,
+        n_process=n_process,
+    )
+    tokens = build_token_table(df["doc_id"], anns)
+
+    print("* tag rows with the mentioned entities")
+    entities = match_entities(content_view(tokens), WATCH_LIST)
+    df["entities"] = df["doc_id"].map(entities).fillna("")
 
-    return df
+    return df, tokens
 
 
 def run():
-    # load CSV data
-    df: pd.DataFrame = pd.read_excel(FN_TWEETS_IN)
+    # load manually curated tweets
+    df: pd.DataFrame = read_table(FN_TWEETS_IN)
 
     # work: tokenize/pos
-    df = do_work(df)
+    df, tokens = do_work(df)
 
     # pipe = transformers.pipeline("ner")
     # pipe(df.iloc[0].text)
@@ -133,24 +86,18 @@ def run():
 
     if ONLY_ABOUT_OTHER:
         # remove all tweets that do not mention the other
-        df = df[df["about_other"]]
-        df.drop(columns="about_other", axis=1, inplace=True)
+        df = df[mentions_other(df)]
+        tokens = tokens[tokens["doc_id"].isin(df["doc_id"])]
 
-        # remove single pairs
-        df.drop(
-            columns=[
-                "words_trump+left",
-                "words_trump+right",
-                "words_biden+left",
-                "words_biden+right",
-            ],
-            axis=1,
-            inplace=True,
-        )
+    save_token_table(tokens, FN_TOKENS_OUT)
+    write_table(df, FN_TWEETS_OUT)
 
-    df.drop(columns="spacy", axis=1, inplace=True)
-    df.to_excel(FN_TWEETS_OUT, index=False)
+    if EXPORT_EXCEL:
+        if EXPORT_TEXT_COLUMNS:
+            df_text = to_text_columns(tokens, df["doc_id"])
+            df = pd.concat([df.reset_index(drop=True), df_text], axis=1)
+        write_table(df, FN_TWEETS_OUT_XLSX)
 
 
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    run()
@@ -1,84 +1,135 @@
-from collections import Counter
+from pathlib import Path
+from typing import Dict
 from warnings import simplefilter
 
 import pandas as pd
 from tqdm import tqdm
 
+from counters import NEIGHBOR_KEYS
+from counters import WORD_KEYS
+from counters import count_tokens
+from counters import count_words
+from counters import doc_fingerprints
+from counters import load_partials
+from counters import merge_counts
+from counters import renumber_docs
+from counters import save_partials
+from counters import top_n
+from mentions import OTHER
+from mentions import mentions_other
+from neighbors import count_neighbors
+from neighbors import to_pairs
+from storage import read_table
+from token_table import content_view
+from token_table import load_token_table
+
 simplefilter(action="ignore", category=FutureWarning)
 tqdm.pandas()
 
-FN_TWEETS_IN = "data/Tweets_R_TrumpBiden_out.xlsx"
+FN_TWEETS_IN = "data/Tweets_R_TrumpBiden_out.parquet"
+FN_TOKENS_IN = "data/Tweets_R_TrumpBiden_tokens.parquet"
 FN_TWEETS_OUT = "data/Tweets_R_TrumpBiden_counters.xlsx"
+FN_COUNTS_CACHE_DIR = Path(".counters_cache")
 
+#: neighbors up to this distance (1 = direct neighbors)
+NEIGHBOR_WINDOW = 1
+#: further words to count neighbors for (in all tweets), e.g. states, policies
+NEIGHBOR_TARGETS = []
 
-def count_neighbors(dfp):
-    npairs = [
-        tuple(w.split("+"))
-        for row in dfp["words_neighbors"]
-        for w in str(row).strip().split(" ")
-        if row
-    ]
-    cnt = Counter(npairs)
-
-    dfpc = pd.DataFrame(
-        [
-            (n, left, right)
-            for (left, right), n in sorted(
-                cnt.items(), key=lambda x: x[1], reverse=True
-            )
-        ],
-        columns=["amount", "left", "right"],
-    )
-    return dfpc
+#: only count new tweets and add them to the stored partial counts (all are
+#: recounted if stored tweets changed or were removed)
+INCREMENTAL = True
+#: rows per sheet, None for all
+TOP_N = None
 
+TWEET_COLUMNS = ["doc_id", "doc_key", "Who", "entities"]
+TOKEN_COLUMNS = ["doc_id", "position", "token", "pos", "is_stop", "is_content"]
 
-def count_words_in_column(dfp, colname):
-    if colname not in dfp.columns:
-        return None
+POS_SHEETS = ("verb", "adjective", "proper_noun", "noun", "pronoun", "adverb", "stop")
 
-    words = [w for row in dfp[colname] for w in str(row).strip().split(" ") if row]
-    cnt = Counter(words)
-    if "nan" in cnt:
-        del cnt["nan"]
 
-    dfpc = pd.DataFrame(
-        [
-            (n, word)
-            for word, n in sorted(cnt.items(), key=lambda x: x[1], reverse=True)
-        ],
-        columns=["amount", "word"],
+def count_partials(
+    df: pd.DataFrame, tokens: pd.DataFrame, who: pd.Series
+) -> Dict[str, pd.DataFrame]:
+    # word counts and neighbors of the other (only in tweets about the other)
+    # and of the further targets, for both persons in one pass
+    words = count_tokens(tokens, who)
+
+    content = content_view(tokens)
+    neighbors_targets = count_neighbors(
+        content, NEIGHBOR_TARGETS, window=NEIGHBOR_WINDOW, groups=who[content.index]
+    )
+    content = content[content["doc_id"].isin(df.loc[mentions_other(df), "doc_id"])]
+    neighbors_other = count_neighbors(
+        content, OTHER.values(), window=NEIGHBOR_WINDOW, groups=who[content.index]
     )
-    return dfpc
+
+    return {
+        "words": words,
+        "neighbors_other": neighbors_other,
+        "neighbors_targets": neighbors_targets,
+    }
 
 
 def run():
-    # load CSV data
-    df: pd.DataFrame = pd.read_excel(FN_TWEETS_IN)
-    writer = pd.ExcelWriter(FN_TWEETS_OUT, engine="xlsxwriter")
-
-    for person in ("Trump", "Biden"):
-        dfp = df[df["Who"] == person]
-
-        # neighbors
-        dfpc = count_neighbors(dfp)
-        dfpc.to_excel(writer, index=False, sheet_name=f"{person} Neighbors (counted)")
-
-        for pos in (
-            "verb",
-            "adjective",
-            "proper_noun",
-            "noun",
-            "pronoun",
-            "adverb",
-            "stop",
-        ):
-            colname = f"text_{pos}"
-            dfppc = count_words_in_column(dfp, colname)
-            if dfppc is not None:
-                dfppc.to_excel(writer, index=False, sheet_name=f"{person} Word ({pos})")
-
-    writer.save()
+    # load only the columns used
+    df: pd.DataFrame = read_table(FN_TWEETS_IN, columns=TWEET_COLUMNS)
+    tokens = load_token_table(FN_TOKENS_IN, columns=TOKEN_COLUMNS)
+    who = tokens["doc_id"].map(df.set_index("doc_id")["Who"])
+
+    # partial counts of already counted tweets, if unchanged
+    config = {"window": NEIGHBOR_WINDOW, "targets": NEIGHBOR_TARGETS, "other": OTHER}
+    fingerprints = doc_fingerprints(df, tokens)
+    docs, partials = load_partials(FN_COUNTS_CACHE_DIR if INCREMENTAL else None, config)
+    known = docs.index.intersection(fingerprints.index)
+    changed = docs.loc[known, "fingerprint"] != fingerprints.loc[known, "fingerprint"]
+    if len(known) < len(docs) or changed.any():
+        print("* counted tweets changed or were removed, recount all")
+        docs, partials = docs[:0], dict()
+
+    # counted tweets keep their key, their doc_id moves with inserted rows
+    doc_ids = pd.Series(
+        fingerprints.loc[docs.index, "doc_id"].to_numpy(), index=docs["doc_id"]
+    )
+    partials = {name: renumber_docs(part, doc_ids) for name, part in partials.items()}
+
+    new = ~df["doc_key"].isin(docs.index)
+    new_tokens = tokens["doc_id"].isin(df.loc[new, "doc_id"])
+    print(f"* count {new.sum()} new tweets ({len(docs)} already counted)")
+    delta = count_partials(df[new], tokens[new_tokens], who[new_tokens])
+
+    keys = {"words": WORD_KEYS}
+    partials = {
+        name: merge_counts([partials.get(name), part], keys.get(name, NEIGHBOR_KEYS))
+        for name, part in delta.items()
+    }
+    if INCREMENTAL:
+        save_partials(FN_COUNTS_CACHE_DIR, config, fingerprints, partials)
+
+    counts_other = partials["neighbors_other"]
+    counts_targets = partials["neighbors_targets"]
+
+    with pd.ExcelWriter(FN_TWEETS_OUT, engine="xlsxwriter") as writer:
+        for person in ("Trump", "Biden"):
+            # neighbors
+            mask = (counts_other["group"] == person) & (
+                counts_other["target"] == OTHER[person]
+            )
+            dfpc = to_pairs(counts_other[mask], TOP_N)
+            sheet_name = f"{person} Neighbors (counted)"
+            dfpc.to_excel(writer, index=False, sheet_name=sheet_name)
+
+            if NEIGHBOR_TARGETS:
+                dfpc = top_n(counts_targets[counts_targets["group"] == person], TOP_N)
+                dfpc = dfpc[["amount", "target", "side", "distance", "neighbor"]]
+                sheet_name = f"{person} Neighbors (targets)"
+                dfpc.to_excel(writer, index=False, sheet_name=sheet_name)
+
+            for pos in POS_SHEETS:
+                dfppc = count_words(partials["words"], person, pos, TOP_N)
+                sheet_name = f"{person} Word ({pos})"
+                dfppc.to_excel(writer, index=False, sheet_name=sheet_name)
 
 
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    run()
@@ -1,39 +1,158 @@
+import argparse
+import json
 import sys
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
 from io import StringIO
 from itertools import zip_longest
 from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
 
 import pandas as pd
 from gensim.models import Word2Vec
 
+from ann_index import SEARCH_K
+from ann_index import fn_index
+from ann_index import load_index
+from embeddings import compare_spaces
+from embeddings import fn_model
+from embeddings import fn_vectors
+from embeddings import load_vectors
+from embeddings import most_similar_batch
+
 
 FN_DOCS_CSV = Path("docs/transcripts.csv")
 TOP_K = 10
 
+PERSONS = ["Trump", "Biden"]
+
+#: approximate search with the ANN index of a model (if built), candidates
+#: per query: SEARCH_K (more: higher recall, slower)
+USE_ANN_INDEX = False
+
+#: speaker comparison (--compare), only words seen at least COMPARE_MIN_COUNT
+#: times by both speakers
+FN_COMPARE_OUT = "w2v_compare_{a}_{b}.csv"
+COMPARE_MIN_COUNT = 5
+
+#: resident query service (--serve)
+HTTP_HOST = "127.0.0.1"
+HTTP_PORT = 8765
+#: cached query results (person, word, top k), least recently used evicted
+CACHE_SIZE = 10_000
+
+CONTENT_TYPES = {"json": "application/json", "csv": "text/csv"}
+
+_vectors = dict()
+_indexes = dict()
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+# ---------------------------------------------------------------------------
+
+
+def get_vectors(person: str):
+    # exported vectors (memory-mapped), loaded once per process
+    if person not in _vectors:
+        fn = fn_model(person)
+        if fn_vectors(fn).exists():
+            _vectors[person] = load_vectors(fn_vectors(fn))
+        else:
+            print(f"* no exported vectors for {person}, load {fn}")
+            _vectors[person] = Word2Vec.load(str(fn)).wv
+    return _vectors[person]
+
+
+def get_index(person: str):
+    # ANN index of the person's model, None: exact search
+    if person not in _indexes:
+        fn = fn_model(person)
+        _indexes[person] = load_index(get_vectors(person), fn_index(fn))
+    return _indexes[person]
+
 
-def run(query):
-    query = query.split(";") if ";" in query else [query]
+def search_similar(person: str, words: List[str], topn: int) -> List[Optional[list]]:
+    kv = get_vectors(person)
+    index = get_index(person) if USE_ANN_INDEX else None
+    if index is None:
+        return most_similar_batch(kv, words, topn)
+    return index.most_similar_batch(kv, words, topn, search_k=SEARCH_K)
 
+
+def query_similar(
+    query: List[str], persons: List[str] = PERSONS, topn: int = TOP_K
+) -> Dict[str, Dict[str, Optional[list]]]:
+    # person -> query word -> [(word, score), ...] (None if not found), words
+    # not in the cache are scored together (one matrix product per model)
+    results = dict()
+    for person in persons:
+        with _cache_lock:
+            missing = [
+                qword
+                for qword in dict.fromkeys(query)
+                if (person, qword, topn) not in _cache
+            ]
+        if missing:
+            sims = search_similar(person, missing, topn)
+            with _cache_lock:
+                for qword, qsims in zip(missing, sims):
+                    _cache[(person, qword, topn)] = qsims
+                while len(_cache) > CACHE_SIZE:
+                    _cache.popitem(last=False)
+
+        with _cache_lock:
+            results[person] = dict()
+            for qword in query:
+                key = (person, qword, topn)
+                if key in _cache:
+                    _cache.move_to_end(key)
+                    results[person][qword] = _cache[key]
+                else:
+                    # evicted while scoring (cache smaller than the query)
+                    results[person][qword] = search_similar(person, [qword], topn)[0]
+    return results
+
+
+def to_table(results: Dict[str, Dict[str, Optional[list]]]) -> pd.DataFrame:
+    # one row per person, query word and rank (no rows for words not found)
+    rows = [
+        (person, qword, rank, word, score)
+        for person, qresults in results.items()
+        for qword, sims in qresults.items()
+        for rank, (word, score) in enumerate(sims or (), 1)
+    ]
+    return pd.DataFrame(rows, columns=["person", "query", "rank", "word", "score"])
+
+
+def parse_query(query: str) -> List[str]:
+    return [qword.strip() for qword in query.split(";")]
+
+
+def format_query(
+    query: List[str], persons: List[str] = PERSONS, topn: int = TOP_K
+) -> str:
+    # side by side, one column per person
     outputs = list()
+    results = query_similar(query, persons, topn)
 
-    for person in ["Trump", "Biden"]:
+    for person in persons:
         fp = StringIO()
-        model = Word2Vec.load(f"{person}.w2v.model")
 
         for qword in query:
-            qword = qword.strip()
-
             print("-" * 40, file=fp)
             print(f"  {person.upper()}  - word: '{qword}'?", file=fp)
             print("-" * 40, file=fp)
 
-            if qword not in model.wv:
+            sims = results[person][qword]
+            if sims is None:
                 print("--> word not found!", file=fp)
-                fp.write("\n" * (TOP_K - 1))
+                fp.write("\n" * (topn - 1))
 
             else:
-                sims = model.wv.most_similar(qword, topn=TOP_K)
-
                 for word, score in sims:
                     print(f"{word:<30} [{score:.3f}]", file=fp)
 
@@ -42,10 +161,146 @@ def run(query):
         outputs.append(fp.getvalue())
 
     lines = zip_longest(*[s.split("\n") for s in outputs], fillvalue="")
-    output = "\n".join(" | ".join([f"{l:<40}" for l in lp]) for lp in lines)
-    print(output)
+    return "\n".join(" | ".join([f"{l:<40}" for l in lp]) for lp in lines)
+
+
+def format_results(query: List[str], persons: List[str], fmt: str, topn: int) -> str:
+    if fmt == "text":
+        return format_query(query, persons, topn)
+    results = query_similar(query, persons, topn)
+    if fmt == "json":
+        return json.dumps(results, ensure_ascii=False, indent=1)
+    if fmt == "csv":
+        return to_table(results).to_csv(index=False)
+    raise Exception(f"Invalid format!? {fmt}")
+
+
+def run(query, fmt="text", topn=TOP_K):
+    print(format_results(parse_query(query), PERSONS, fmt, topn))
+
+
+def compare(person_a: str, person_b: str, min_count: int = COMPARE_MIN_COUNT):
+    # how differently both use their shared words, ranked (aligned spaces)
+    df = compare_spaces(
+        get_vectors(person_a), get_vectors(person_b), k=TOP_K, min_count=min_count
+    )
+    df = df.rename(columns={"count_a": person_a, "count_b": person_b})
+    fn = FN_COMPARE_OUT.format(a=person_a, b=person_b)
+    df.to_csv(fn, index=False)
+    print(f"* {len(df)} shared words (seen >= {min_count} times) -> {fn}")
+    print(df.head(TOP_K * 2).to_string(index=False))
+
+
+# ---------------------------------------------------------------------------
+
+
+def repl():
+    # models stay loaded, one query (words separated by ";") per line
+    for person in PERSONS:
+        get_vectors(person)
+    print("* query words (separated by ';'), empty line to quit")
+    for line in sys.stdin:
+        if not line.strip():
+            break
+        print(format_query(parse_query(line)))
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    # GET /similar?q=war;money[&person=Trump][&topn=10][&format=text|csv]
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if url.path != "/similar" or "q" not in params:
+            self.send_error(404, "use /similar?q=word1;word2")
+            return
+
+        query = parse_query(params["q"][0])
+        persons = params.get("person", PERSONS)
+        fmt = params.get("format", ["json"])[0]
+        try:
+            topn = int(params.get("topn", [TOP_K])[0])
+            body = format_results(query, persons, fmt, topn).encode("utf-8")
+            content_type = CONTENT_TYPES.get(fmt, "text/plain") + "; charset=utf-8"
+        except Exception as ex:
+            self.send_error(400, str(ex))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(host: str = HTTP_HOST, port: int = HTTP_PORT):
+    for person in PERSONS:
+        get_vectors(person)
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    print(f"* serve queries on http://{host}:{port}/similar?q=word1;word2")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+# ---------------------------------------------------------------------------
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Most similar words per speaker model (side by side)"
+    )
+    parser.add_argument("query", nargs="?", help="words, separated by ';'")
+    parser.add_argument(
+        "--query-file", help="file with query words (one per line or ';')"
+    )
+    parser.add_argument(
+        "--format", choices=("text", "json", "csv"), default="text"
+    )
+    parser.add_argument("--topn", type=int, default=TOP_K)
+    parser.add_argument(
+        "--ann", action="store_true", help="approximate search (ANN index)"
+    )
+    parser.add_argument("--search-k", type=int, help="ANN candidates per query")
+    parser.add_argument(
+        "--repl", action="store_true", help="keep models loaded, read queries"
+    )
+    parser.add_argument(
+        "--serve", action="store_true", help="keep models loaded, HTTP/JSON"
+    )
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("PERSON_A", "PERSON_B"),
+        help="rank the shared words by displacement (aligned embeddings)",
+    )
+    parser.add_argument("--min-count", type=int, default=COMPARE_MIN_COUNT)
+    parser.add_argument("--host", default=HTTP_HOST)
+    parser.add_argument("--port", type=int, default=HTTP_PORT)
+    args = parser.parse_args()
+
+    global USE_ANN_INDEX, SEARCH_K
+    USE_ANN_INDEX = USE_ANN_INDEX or args.ann
+    SEARCH_K = args.search_k or SEARCH_K
+
+    if args.compare:
+        compare(*args.compare, min_count=args.min_count)
+    elif args.serve:
+        serve(args.host, args.port)
+    elif args.repl:
+        repl()
+    elif args.query_file:
+        with open(args.query_file, "r", encoding="utf-8") as fp:
+            query = ";".join(line.strip() for line in fp if line.strip())
+        run(query, fmt=args.format, topn=args.topn)
+    elif args.query:
+        run(args.query, fmt=args.format, topn=args.topn)
+    else:
+        parser.error("query, --query-file, --compare, --repl or --serve required")
 
 
 if __name__ == "__main__":
-    word = sys.argv[1]
-    run(word)
\ No newline at end of file
+    main()
@@ -0,0 +1,125 @@
+import argparse
+import os
+from pathlib import Path
+from typing import List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+class ChunkWriter:
+    # appends DataFrame chunks to one output file, format by file extension:
+    # ".csv" / ".jsonl" (line-oriented) or ".parquet" (columnar, pyarrow)
+
+    def __init__(self, fn: os.PathLike):
+        self.fn = Path(fn)
+        self.num_rows = 0
+        self._fp = None
+        self._header = True
+        self._writer = None
+        self._schema = None
+
+        if self.fn.suffix not in (".csv", ".jsonl", ".parquet"):
+            raise Exception(f"Invalid format!? {self.fn}")
+
+    def write(self, df: pd.DataFrame):
+        if self.fn.suffix == ".parquet":
+            self._write_parquet(df)
+        else:
+            if self._fp is None:
+                self._fp = open(self.fn, "w", encoding="utf-8", newline="")
+            if self.fn.suffix == ".csv":
+                df.to_csv(self._fp, index=False, header=self._header)
+                self._header = False
+            else:
+                lines = df.to_json(orient="records", lines=True, force_ascii=False)
+                if lines and not lines.endswith("\n"):
+                    lines += "\n"
+                self._fp.write(lines)
+        self.num_rows += len(df)
+
+    def _write_parquet(self, df: pd.DataFrame):
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self._writer is None:
+            # columns with only missing values in the first chunk hold text
+            self._schema = pa.schema(
+                [
+                    field.with_type(pa.string())
+                    if pa.types.is_null(field.type)
+                    else field
+                    for field in table.schema
+                ],
+                metadata=table.schema.metadata,
+            )
+            self._writer = pq.ParquetWriter(self.fn, self._schema)
+        self._writer.write_table(table.cast(self._schema))
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# ---------------------------------------------------------------------------
+
+
+def write_table(df: pd.DataFrame, fn: os.PathLike):
+    # inter-stage tables as ".parquet" (typed, columnar), ".xlsx" only as
+    # explicit export for reading
+    fn = Path(fn)
+    if fn.suffix == ".xlsx":
+        df.to_excel(fn, index=False)
+    else:
+        with ChunkWriter(fn) as writer:
+            writer.write(df)
+
+
+def read_table(fn: os.PathLike, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    # only the given columns are read (for ".parquet" not even decoded)
+    fn = Path(fn)
+    if fn.suffix == ".parquet":
+        return pq.read_table(fn, columns=columns).to_pandas()
+    if fn.suffix == ".xlsx":
+        return pd.read_excel(fn, usecols=columns)
+    if fn.suffix == ".csv":
+        return pd.read_csv(fn, usecols=columns)
+    if fn.suffix == ".jsonl":
+        df = pd.read_json(fn, orient="records", lines=True)
+        return df if columns is None else df[columns]
+    raise Exception(f"Invalid format!? {fn}")
+
+
+def export_excel(
+    fn_in: os.PathLike, fn_out: os.PathLike, columns: Optional[List[str]] = None
+):
+    print(f"* export {fn_in} -> {fn_out}")
+    write_table(read_table(fn_in, columns=columns), fn_out)
+
+
+# ---------------------------------------------------------------------------
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export an intermediate table (e.g. .parquet) to Excel"
+    )
+    parser.add_argument("input", help="table file (.parquet, .csv, .jsonl)")
+    parser.add_argument("output", help="output file (.xlsx)")
+    parser.add_argument("--columns", nargs="*", help="only these columns")
+    args = parser.parse_args()
+
+    export_excel(args.input, args.output, columns=args.columns)
+
+
+if __name__ == "__main__":
+    main()
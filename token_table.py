@@ -0,0 +1,92 @@
+import os
+from typing import Iterable, List, Optional
+
+import pandas as pd
+
+from nlp_pipeline import Annotation
+from storage import read_table
+from storage import write_table
+
+
+#: not counted as content words (+ stopwords)
+EXCLUDED_POS = ("PUNCT", "SYM", "CCONJ", "CONJ", "SCONJ", "SPACE")
+
+#: word class views on the content words, "stop" are all stopwords
+POS_VIEWS = {
+    "verb": ("VERB",),
+    "adjective": ("ADJ",),
+    "proper_noun": ("PROPN",),
+    "noun": ("NOUN",),
+    "pronoun": ("PRON",),
+    "adverb": ("ADV",),
+    "propn_adj": ("ADJ", "PROPN"),
+}
+
+# ---------------------------------------------------------------------------
+
+
+def build_token_table(
+    doc_ids: Iterable[int], anns: Iterable[Annotation]
+) -> pd.DataFrame:
+    # long format, one row per token: doc_id, position, token, pos, is_stop
+    doc_col, pos_col, token_col, tag_col, stop_col = [], [], [], [], []
+    for doc_id, ann in zip(doc_ids, anns):
+        doc_col.extend([doc_id] * len(ann.words))
+        pos_col.extend(range(len(ann.words)))
+        token_col.extend(ann.words)
+        tag_col.extend(ann.pos)
+        stop_col.extend(ann.is_stop)
+
+    df = pd.DataFrame(
+        {
+            "doc_id": pd.Series(doc_col, dtype="int64"),
+            "position": pd.Series(pos_col, dtype="int32"),
+            "token": pd.Series(token_col, dtype="object"),
+            "pos": pd.Series(tag_col, dtype="category"),
+            "is_stop": pd.Series(stop_col, dtype="bool"),
+        }
+    )
+    df["is_content"] = ~df["is_stop"] & ~df["pos"].isin(EXCLUDED_POS)
+
+    return df
+
+
+def content_view(tokens: pd.DataFrame) -> pd.DataFrame:
+    # content words in document order (before: "text_tokens" column)
+    return tokens[tokens["is_content"]]
+
+
+def pos_view(tokens: pd.DataFrame, name: str) -> pd.DataFrame:
+    # before: "text_<name>" columns
+    if name == "stop":
+        return tokens[tokens["is_stop"]]
+    return tokens[tokens["is_content"] & tokens["pos"].isin(POS_VIEWS[name])]
+
+
+def to_text_columns(tokens: pd.DataFrame, doc_ids: Iterable[int]) -> pd.DataFrame:
+    # space-joined "text_*" columns (one row per document), only for reading
+    views = {
+        "text_stop": pos_view(tokens, "stop"),
+        "text_tokens": content_view(tokens),
+    }
+    views.update({f"text_{name}": pos_view(tokens, name) for name in POS_VIEWS})
+
+    df = pd.DataFrame(index=pd.Index(doc_ids, name="doc_id"))
+    for column, view in views.items():
+        df[column] = view.groupby("doc_id")["token"].agg(" ".join)
+    df["text_pos"] = content_view(tokens).groupby("doc_id")["pos"].agg(
+        lambda tags: " ".join(map(str, tags))
+    )
+    columns = ["text_stop", "text_tokens", "text_pos"]
+    columns += [f"text_{name}" for name in POS_VIEWS]
+    return df[columns].fillna("").reset_index(drop=True)
+
+
+def save_token_table(tokens: pd.DataFrame, fn: os.PathLike):
+    write_table(tokens, fn)
+
+
+def load_token_table(
+    fn: os.PathLike, columns: Optional[List[str]] = None
+) -> pd.DataFrame:
+    return read_table(fn, columns=columns)
@@ -0,0 +1,286 @@
+import argparse
+import os
+import re
+from concurrent.futures import Executor
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Callable, List, Optional, Tuple
+
+import pandas as pd
+from tqdm import tqdm
+
+from storage import ChunkWriter
+
+
+#: rows per chunk in streaming mode
+CHUNK_SIZE = 50_000
+#: worker processes for cleanup (1 = serial), tweets per worker task
+WORKERS = 1
+WORKER_CHUNK_SIZE = 5_000
+
+
+PAT_WHITESPACES = re.compile(r"\s+", re.DOTALL | re.MULTILINE | re.DOTALL)
+PAT_HASHTAG = re.compile(r"#[^ ]+", re.UNICODE | re.IGNORECASE | re.DOTALL)
+PAT_MENTION = re.compile(r"@[\w_]+", re.UNICODE | re.IGNORECASE | re.DOTALL)
+PAT_RETWEET = re.compile(
+    r"^RT (" + PAT_MENTION.pattern + "):", re.UNICODE | re.IGNORECASE | re.DOTALL
+)
+PAT_RETWEET_TOKEN = re.compile(
+    r"(" + PAT_MENTION.pattern + "):", re.UNICODE | re.IGNORECASE | re.DOTALL
+)
+PAT_URL = re.compile(
+    r"""\b((?:[a-z][\w-]+:(?:/{1,3}|[a-z0-9%])|www\d{0,3}[.]|[a-z0-9.\-]+[.][a-z]{2,4}/)(?:[^\s()<>]+|\(([^\s()<>]+|(\([^\s()<>]+\)))*\))+(?:\(([^\s()<>]+|(\([^\s()<>]+\)))*\)|[^\s`!()\[\]{};:'".,<>?«»“”‘’]))""",
+    re.UNICODE | re.IGNORECASE | re.DOTALL,
+)
+# same as PAT_URL without nested quantifiers (no catastrophic backtracking),
+# at most quadratic in the token length
+_PAT_URL_PARENS = r"\((?:[^\s()<>]|\([^\s()<>]+\))*\)"
+PAT_URL_BOUNDED = re.compile(
+    r"""\b((?:[a-z][\w-]+:(?:/{1,3}|[a-z0-9%])|www\d{0,3}[.]|[a-z0-9.\-]+[.][a-z]{2,4}/)(?:[^\s()<>]|"""
+    + _PAT_URL_PARENS
+    + r""")+(?:"""
+    + _PAT_URL_PARENS
+    + r"""|[^\s`!()\[\]{};:'".,<>?«»“”‘’]))""",
+    re.UNICODE | re.IGNORECASE | re.DOTALL,
+)
+PAT_PUNCT = re.compile(r"""[!?"“”`´*~+/\\]""", re.UNICODE | re.IGNORECASE | re.DOTALL)
+# —Joe ?
+PAT_PUNCT2 = re.compile(r"(\W|['_—-])+\s", re.UNICODE | re.IGNORECASE | re.DOTALL)
+
+# https://github.com/adonoho/TweetTokenizers/blob/master/PottsTweetTokenizer.py
+# https://gist.github.com/gruber/8891611
+
+# ---------------------------------------------------------------------------
+
+
+def _is_url_candidate(token: str) -> bool:
+    # every URL match needs a scheme (":"), "www" or a path ("/")
+    return ":" in token or "/" in token or "www" in token.lower()
+
+
+def _rstrip_punct(token: str) -> str:
+    # like PAT_PUNCT2: trailing "\W" and "'_—-" (everything but alphanumeric)
+    end = len(token)
+    while end and not token[end - 1].isalnum():
+        end -= 1
+    return token[:end]
+
+
+def clean_tweet(
+    text: str, keep_mentions_in_text: bool = True
+) -> Tuple[str, str, Optional[str], str]:
+    # returns: text, hashtags, retweet, mentions
+    # single tokenization (whitespace) with the same result as the previous
+    # regex stages applied on the whole text one after another
+
+    # extract hashtags, they run from the first "#" to the end of a token
+    tokens, hashtags = list(), list()
+    for token in text.split():
+        pos = token.find("#")
+        if pos != -1 and pos < len(token) - 1:
+            hashtags.append(token[pos:].rstrip(""".!;:?"'"""))
+            token = token[:pos]
+            if not token:
+                continue
+        tokens.append(token)
+
+    # check re-tweets ("RT @user:")
+    retweet = None
+    if len(tokens) > 1 and tokens[0].lower() == "rt":
+        match = PAT_RETWEET_TOKEN.match(tokens[1])
+        if match:
+            retweet = match.group(1)
+            rest = tokens[1][match.end() :]
+            tokens = ([rest] if rest else []) + tokens[2:]
+
+    words, mentions = list(), list()
+    for token in tokens:
+        parts = [token]
+
+        # extract mentions
+        if "@" in token:
+            mentions.extend(PAT_MENTION.findall(token))
+            if not keep_mentions_in_text:
+                parts = PAT_MENTION.sub(" ", token).split()
+
+        # remove URLs
+        if any(_is_url_candidate(part) for part in parts):
+            parts = [
+                piece
+                for part in parts
+                for piece in PAT_URL_BOUNDED.sub(" ", part).split()
+            ]
+
+        # remove punctuation (inside and at the end of words)
+        for part in parts:
+            for piece in PAT_PUNCT.sub(" ", part).split():
+                piece = _rstrip_punct(piece)
+                if piece:
+                    words.append(piece)
+
+    return " ".join(words), " ".join(hashtags), retweet, " ".join(mentions)
+
+
+def _clean_tweets(texts: List[str], keep_mentions_in_text: bool = True) -> list:
+    return [clean_tweet(text, keep_mentions_in_text) for text in texts]
+
+
+def clean_tweets(
+    texts: List[str],
+    keep_mentions_in_text: bool = True,
+    workers: int = WORKERS,
+    chunk_size: int = WORKER_CHUNK_SIZE,
+    executor: Optional[Executor] = None,
+    verbose: bool = True,
+) -> list:
+    # serial, or sharded over worker processes (results in input order)
+    if executor is None and (workers <= 1 or len(texts) <= chunk_size):
+        return [
+            clean_tweet(text, keep_mentions_in_text)
+            for text in tqdm(texts, disable=not verbose)
+        ]
+
+    shards = [texts[pos : pos + chunk_size] for pos in range(0, len(texts), chunk_size)]
+    work = partial(_clean_tweets, keep_mentions_in_text=keep_mentions_in_text)
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        results = executor.map(work, shards)
+        results = list(tqdm(results, total=len(shards), disable=not verbose))
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+    return [result for shard in results for result in shard]
+
+
+def cleanup(
+    df,
+    keep_mentions_in_text=True,
+    verbose=True,
+    workers=WORKERS,
+    chunk_size=WORKER_CHUNK_SIZE,
+    executor=None,
+):
+    if verbose:
+        print("* cleanup text, extract hashtags, re-tweets, mentions")
+    # empty cells (NaN) as empty texts, trimmed afterwards
+    results = clean_tweets(
+        df["text"].fillna("").tolist(),
+        keep_mentions_in_text=keep_mentions_in_text,
+        workers=workers,
+        chunk_size=chunk_size,
+        executor=executor,
+        verbose=verbose,
+    )
+    texts, hashtags, retweets, mentions = zip(*results) if results else ([],) * 4
+
+    df = df.copy()
+    df["text"] = list(texts)
+    df["hashtags"] = list(hashtags)
+    df["retweet"] = list(retweets)
+    df["mentions"] = list(mentions)
+
+    return df
+
+
+def trim_empty(df, verbose=True):
+    len_before = len(df)
+
+    mask_empty = df["text"] == ""
+    df = df[~mask_empty]
+
+    len_after = len(df)
+    if verbose:
+        print(f"Trim empty tweets: {len_before} -> {len_after}")
+
+    return df
+
+
+def run_streaming(
+    fn_in: os.PathLike,
+    fn_out: os.PathLike,
+    prepare: Callable[[pd.DataFrame], pd.DataFrame],
+    chunk_size: int = CHUNK_SIZE,
+    keep_mentions_in_text: bool = True,
+    workers: int = WORKERS,
+    worker_chunk_size: int = WORKER_CHUNK_SIZE,
+):
+    # read, clean and append chunk by chunk, memory does not grow with the input
+    print(f"* stream {fn_in} -> {fn_out} (chunks of {chunk_size} rows)")
+    num_in = 0
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        with ChunkWriter(fn_out) as writer:
+            # all columns as text, types inferred per chunk could differ
+            chunks = pd.read_csv(fn_in, chunksize=chunk_size, dtype=str)
+            for df in tqdm(chunks, desc="Cleanup chunks"):
+                num_in += len(df)
+                df = prepare(df)
+                df = cleanup(
+                    df,
+                    keep_mentions_in_text=keep_mentions_in_text,
+                    verbose=False,
+                    chunk_size=worker_chunk_size,
+                    executor=executor,
+                )
+                df = trim_empty(df, verbose=False)
+                writer.write(df)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    print(f"Trim empty tweets: {num_in} -> {writer.num_rows}")
+
+
+# ---------------------------------------------------------------------------
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Cleanup a (large) tweet archive CSV, streaming in chunks"
+    )
+    parser.add_argument("input", help="CSV file with tweets")
+    parser.add_argument("output", help="output file (.csv, .jsonl, .parquet)")
+    parser.add_argument("--text-column", default="text")
+    parser.add_argument(
+        "--keep-columns",
+        nargs="*",
+        default=list(),
+        help="other columns to copy, e.g. timestamp, account",
+    )
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="worker processes, 1 = serial",
+    )
+    parser.add_argument(
+        "--worker-chunk-size",
+        type=int,
+        default=WORKER_CHUNK_SIZE,
+        help="tweets per worker task",
+    )
+    parser.add_argument("--remove-mentions", action="store_true")
+    args = parser.parse_args()
+
+    def prepare(df):
+        df = df[args.keep_columns + [args.text_column]]
+        return df.rename(columns={args.text_column: "text"})
+
+    run_streaming(
+        args.input,
+        args.output,
+        prepare,
+        chunk_size=args.chunk_size,
+        keep_mentions_in_text=not args.remove_mentions,
+        workers=args.workers,
+        worker_chunk_size=args.worker_chunk_size,
+    )
+
+
+if __name__ == "__main__":
+    main()